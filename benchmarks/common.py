@@ -0,0 +1,150 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks which need the database run on a fresh test database (created
+and destroyed like `manage.py test` does) with whatever settings
+`DJANGO_SETTINGS_MODULE` points to, so run them against MySQL with e.g.:
+
+    env DJANGO_SETTINGS_MODULE=spreadr.settings_analysis DB_NAME=spreadr \
+        python benchmarks/lock_random_tree.py
+
+"""
+
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spreadr.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    # Let the test client through production settings
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+
+
+@contextmanager
+def test_database():
+    from django.db import connection
+    from django.core.cache import cache
+
+    print('Database: {} ({})'.format(connection.settings_dict['NAME'],
+                                     connection.vendor))
+    if connection.vendor == 'sqlite':
+        # Threads can't write concurrently to sqlite's in-memory test
+        # database, so use a file
+        test = connection.settings_dict['TEST']
+        if test.get('NAME') is None:
+            test['NAME'] = os.path.join(ROOT, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0)
+    cache.clear()
+    try:
+        yield
+    finally:
+        cache.clear()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def create_profiles(n, prefix='participant'):
+    from django.contrib.auth.models import User
+    from gists.models import Profile
+
+    profiles = []
+    for i in range(n):
+        user = User.objects.create_user('{}{}'.format(prefix, i),
+                                        password='pass')
+        profiles.append(Profile.objects.create(user=user,
+                                               mothertongue='english'))
+    return profiles
+
+
+def seed_trees(n, author, bucket='experiment', batch_size=1000):
+    """Create `n` trees each with a root sentence by `author`, with their
+    materialized attributes set, and return their pks."""
+    from gists.models import Tree, Sentence
+
+    first = Tree.objects.count()
+    for start in range(0, n, batch_size):
+        size = min(batch_size, n - start)
+        Tree.objects.bulk_create([
+            Tree(sentences_count=1, has_root=True, root_language='english',
+                 root_bucket=bucket) for _ in range(size)])
+    pks = list(Tree.objects.order_by('pk')
+               .values_list('pk', flat=True)[first:])
+
+    for start in range(0, n, batch_size):
+        Sentence.objects.bulk_create([
+            Sentence(tree_id=pk, tree_as_root_id=pk, profile=author,
+                     text='A root sentence for the benchmark.',
+                     read_time_proportion=.5, read_time_allotted=10,
+                     write_time_proportion=.5, write_time_allotted=20,
+                     language='english', bucket=bucket)
+            for pk in pks[start:start + batch_size]])
+    return pks
+
+
+def run_threads(n, target):
+    """Run `target(i)` in `n` threads at once, closing their database
+    connections when they are done."""
+    from django.db import connection
+
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def run(i):
+        try:
+            barrier.wait()
+            target(i)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return time.time() - start
+
+
+def row_lock_status():
+    """InnoDB's cumulated row lock waits and wait time (in ms), or None on
+    other databases."""
+    from django.db import connection
+
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN "
+                       "('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+        status = dict(cursor.fetchall())
+    return (int(status['Innodb_row_lock_waits']),
+            int(status['Innodb_row_lock_time']))
+
+
+def report_row_locks(before, after):
+    if before is None:
+        print('Row lock waits: n/a on this database')
+        return
+    print('Row lock waits: {}, total wait {} ms'
+          .format(after[0] - before[0], after[1] - before[1]))
+
+
+def report_latencies(name, durations):
+    durations = np.array(durations) * 1000
+    print('{}: {} calls, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'
+          .format(name, len(durations), np.percentile(durations, 50),
+                  np.percentile(durations, 99), durations.max()))
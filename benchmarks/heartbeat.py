@@ -0,0 +1,100 @@
+"""Tree lock heartbeats per second under concurrent participants.
+
+Each thread is a participant holding locks on a few trees and heartbeating
+them, either one request per tree (`/api/trees/{id}/heartbeat/`) or all at
+once (`/api/trees/heartbeats/`), and we report the throughput in heartbeats
+per second and the request latencies. Pass `--backend
+gists.locking.CacheLeases` to keep the leases in the cache (which needs a
+shared cache with an atomic add() to be meaningful across processes).
+
+"""
+
+import json
+import time
+import argparse
+
+from common import (setup_django, test_database, create_profiles,
+                    seed_trees, run_threads, row_lock_status,
+                    report_row_locks, report_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=16,
+                        help='number of concurrent participants')
+    parser.add_argument('--locks', type=int, default=5,
+                        help='number of trees locked by each participant')
+    parser.add_argument('--rounds', type=int, default=50,
+                        help='number of times each participant heartbeats '
+                        'all its trees')
+    parser.add_argument('--batch', action='store_true',
+                        help='heartbeat all trees in one request')
+    parser.add_argument('--backend', help='lease backend to use instead of '
+                        'LEASE_BACKEND')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.test import Client
+    from gists.config import get_config
+    from gists.locking import claim_tree
+
+    if args.backend is not None:
+        settings.LEASE_BACKEND = args.backend
+    if settings.LEASE_BACKEND == 'gists.locking.CacheLeases' \
+            and 'leases' not in settings.CACHES:
+        # Threads of a single process can share an in-memory cache
+        settings.CACHES['leases'] = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        settings.LEASE_CACHE = 'leases'
+    print('Lease backend: {}'.format(settings.LEASE_BACKEND))
+
+    with test_database():
+        author, = create_profiles(1, prefix='author')
+        pks = seed_trees(args.threads * args.locks, author)
+        profiles = create_profiles(args.threads)
+        timeout = get_config().heartbeat_timeout
+        held = []
+        for i, profile in enumerate(profiles):
+            held.append(pks[i * args.locks:(i + 1) * args.locks])
+            for pk in held[i]:
+                claim_tree(pk, profile, timeout)
+        durations = [[] for _ in profiles]
+
+        def heartbeat(i):
+            client = Client()
+            client.force_login(profiles[i].user)
+            for _ in range(args.rounds):
+                if args.batch:
+                    start = time.time()
+                    response = client.put(
+                        '/api/trees/heartbeats/',
+                        data=json.dumps({'trees': held[i]}),
+                        content_type='application/json')
+                    durations[i].append(time.time() - start)
+                    assert response.status_code == 200, response.status_code
+                    assert len(response.json()['lost']) == 0
+                else:
+                    for pk in held[i]:
+                        start = time.time()
+                        response = client.put(
+                            '/api/trees/{}/heartbeat/'.format(pk))
+                        durations[i].append(time.time() - start)
+                        assert response.status_code == 200, \
+                            response.status_code
+
+        locks_before = row_lock_status()
+        elapsed = run_threads(args.threads, heartbeat)
+        locks_after = row_lock_status()
+
+    total = args.threads * args.locks * args.rounds
+    print('{} participants holding {} trees each: {} heartbeats in {:.2f}s '
+          '({:.0f} heartbeats/s)'.format(args.threads, args.locks, total,
+                                         elapsed, total / elapsed))
+    report_latencies('heartbeats' if args.batch else 'heartbeat',
+                     [d for thread in durations for d in thread])
+    report_row_locks(locks_before, locks_after)
+
+
+if __name__ == '__main__':
+    main()
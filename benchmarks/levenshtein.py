@@ -0,0 +1,113 @@
+"""Levenshtein implementations on realistic sentence pairs.
+
+Pairs are made of a sentence the length of those participants read (a few
+hundred characters) and a reformulation of it with words dropped, replaced
+or swapped, like the children sentences whose `parent_errs` we compute.
+Each sentence gets several reformulations (`--children`), as parents do in
+trees, which `levenshtein_batch` takes advantage of. We check that all
+implementations agree, then report the time per pair of each.
+
+"""
+
+import sys
+import time
+import random
+import argparse
+
+from common import ROOT
+
+
+WORDS = ('the a of to and in that was for it with he on as his by at '
+         'they from she this had be her not but what all were when we '
+         'there can an your which their said if do will each about how '
+         'up out them then many some so these would other into has more '
+         'two like him see time could no make than first been its who now '
+         'people my made over did down only way find use may water long '
+         'little very after words called just where most know').split()
+
+
+def sentence(rng, length):
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(WORDS))
+    return ' '.join(words).capitalize() + '.'
+
+
+def reformulate(rng, text, edits):
+    words = text.split(' ')
+    for _ in range(edits):
+        i = rng.randrange(len(words))
+        change = rng.random()
+        if change < .4 and len(words) > 1:
+            del words[i]
+        elif change < .8:
+            words[i] = rng.choice(WORDS)
+        else:
+            j = rng.randrange(len(words))
+            words[i], words[j] = words[j], words[i]
+    return ' '.join(words)
+
+
+def make_pairs(n, children, min_length, max_length, max_edits, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    while len(pairs) < n:
+        parent = sentence(rng, rng.randint(min_length, max_length))
+        for _ in range(min(children, n - len(pairs))):
+            pairs.append((parent, reformulate(rng, parent,
+                                              rng.randint(0, max_edits))))
+    return pairs
+
+
+def timed(function, pairs):
+    start = time.time()
+    distances = [function(s1, s2) for s1, s2 in pairs]
+    return time.time() - start, distances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pairs', type=int, default=500,
+                        help='number of sentence pairs')
+    parser.add_argument('--children', type=int, default=4,
+                        help='number of reformulations of each sentence')
+    parser.add_argument('--min-length', type=int, default=100)
+    parser.add_argument('--max-length', type=int, default=300)
+    parser.add_argument('--max-edits', type=int, default=10,
+                        help='maximum number of word edits per pair')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from gists.utils import (levenshtein, bitparallel_levenshtein,
+                             c_levenshtein, levenshtein_batch)
+
+    pairs = make_pairs(args.pairs, args.children, args.min_length,
+                       args.max_length, args.max_edits)
+    print('{} pairs of {} to {} characters, {} reformulations per sentence'
+          .format(len(pairs), args.min_length, args.max_length,
+                  args.children))
+
+    implementations = [('levenshtein', levenshtein),
+                       ('bitparallel_levenshtein', bitparallel_levenshtein)]
+    if c_levenshtein is not None:
+        implementations.append(('Levenshtein.distance', c_levenshtein))
+    else:
+        print('Levenshtein.distance: not installed')
+
+    reference = None
+    for name, function in implementations:
+        elapsed, distances = timed(function, pairs)
+        if reference is None:
+            reference = distances
+        assert distances == reference, name + ' disagrees'
+        print('{}: {:.3f} ms per pair'
+              .format(name, elapsed * 1000 / len(pairs)))
+
+    start = time.time()
+    assert levenshtein_batch(pairs) == reference
+    print('levenshtein_batch: {:.3f} ms per pair'
+          .format((time.time() - start) * 1000 / len(pairs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Concurrent participants claiming trees through `lock_random_tree`.
+
+Each thread is a participant repeatedly asking for a random tree lock (then
+releasing it, as adding a sentence would), and we report the latency of the
+requests, the proportion that came back empty although free trees were left,
+and on MySQL the InnoDB row lock waits the run caused. Run it on the MySQL
+settings to get meaningful lock contention, e.g.:
+
+    env DJANGO_SETTINGS_MODULE=spreadr.settings_analysis DB_NAME=spreadr \
+        python benchmarks/lock_random_tree.py --threads 32
+
+"""
+
+import time
+import argparse
+
+from common import (setup_django, test_database, create_profiles,
+                    seed_trees, run_threads, row_lock_status,
+                    report_row_locks, report_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=16,
+                        help='number of concurrent participants')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='number of tree locks requested by each '
+                        'participant')
+    parser.add_argument('--trees', type=int, default=1000,
+                        help='number of trees to claim from')
+    parser.add_argument('--shaping', action='store_true',
+                        help='ask for shaped trees first')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from gists.models import Tree
+    from gists.locking import release_tree
+
+    url = '/api/trees/lock_random_tree/'
+    if args.shaping:
+        url += '?priority_shaping=true'
+
+    with test_database():
+        author, = create_profiles(1, prefix='author')
+        seed_trees(args.trees, author)
+        profiles = create_profiles(args.threads)
+        durations = [[] for _ in profiles]
+        empty = [0 for _ in profiles]
+
+        def participate(i):
+            client = Client()
+            client.force_login(profiles[i].user)
+            for _ in range(args.requests):
+                start = time.time()
+                response = client.get(url)
+                durations[i].append(time.time() - start)
+                assert response.status_code == 200, response.status_code
+
+                trees = response.json()
+                if len(trees) == 0:
+                    empty[i] += 1
+                else:
+                    release_tree(Tree(pk=trees[0]['id']))
+
+        locks_before = row_lock_status()
+        elapsed = run_threads(args.threads, participate)
+        locks_after = row_lock_status()
+
+    total = args.threads * args.requests
+    print('{} participants, {} trees: {} requests in {:.2f}s ({:.0f}/s)'
+          .format(args.threads, args.trees, total, elapsed,
+                  total / elapsed))
+    report_latencies('lock_random_tree',
+                     [d for thread in durations for d in thread])
+    print('Empty answers: {} ({:.1%})'.format(sum(empty),
+                                              sum(empty) / total))
+    report_row_locks(locks_before, locks_after)
+
+
+if __name__ == '__main__':
+    main()
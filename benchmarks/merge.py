@@ -0,0 +1,99 @@
+"""Merging synthetic batch dumps with `merge_dbs.Merger`.
+
+Each batch is a dump like `export_db.sh` produces, with pks starting at 1 in
+every batch (as in separate databases), one tree for every 10 sentences and
+one profile for every 20. We report the time taken to index the dumps and
+to merge them, and the time to serialize the output like `merge_dbs.py`
+does.
+
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+
+from common import ROOT
+
+
+def fields(names, **values):
+    """Placeholder values for all `names`, overridden by `values`."""
+    instance = dict((name, None) for name in names)
+    instance.update(values)
+    return instance
+
+
+def make_batch(models, index, n_sentences):
+    n_trees = max(1, n_sentences // 10)
+    n_profiles = max(1, n_sentences // 20)
+    instances = []
+
+    def add(model, pk, **values):
+        instances.append({'model': model, 'pk': pk,
+                          'fields': fields(models[model], **values)})
+
+    add('sites.site', 1, domain='gistr.io', name='Gistr')
+    add('gists.gistsconfiguration', 1, target_branch_depth=8)
+    for pk in range(1, n_profiles + 1):
+        username = 'batch{}-user{}'.format(index, pk)
+        add('auth.user', pk, username=username, groups=[],
+            user_permissions=[])
+        add('account.emailaddress', pk, user=pk,
+            email=username + '@example.com')
+        add('gists.profile', pk, user=pk, mothertongue='english')
+        add('gists.profilestats', pk, profile=pk)
+        add('gists.profilebucketcounts', pk, profile=pk, bucket='experiment')
+        add('gists.comment', pk, profile=pk, text='A comment.')
+        add('gists.questionnaire', pk, profile=pk, age=30)
+    for pk in range(1, n_trees + 1):
+        add('gists.tree', pk, profile_lock=None, sentences_count=10)
+    for pk in range(1, n_sentences + 1):
+        tree = (pk - 1) % n_trees + 1
+        is_root = pk <= n_trees
+        add('gists.sentence', pk, tree=tree,
+            profile=(pk - 1) % n_profiles + 1,
+            parent=None if is_root else pk - n_trees,
+            tree_as_root=tree if is_root else None,
+            head=None if pk <= 2 * n_trees else tree + n_trees,
+            text='A sentence in a synthetic batch.')
+    return instances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--batches', type=int, default=3)
+    parser.add_argument('--sentences', type=int, default=20000,
+                        help='number of sentences per batch')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from merge_dbs import Merger
+
+    models = dict(Merger.MODELS)
+    dbs = [make_batch(models, i, args.sentences)
+           for i in range(args.batches)]
+    total = sum(len(db) for db in dbs)
+    print('{} batches of {} sentences, {} instances in total'
+          .format(args.batches, args.sentences, total))
+
+    start = time.time()
+    merger = Merger(dbs)
+    del dbs
+    indexed = time.time()
+    merged = list(merger.merge_dbs())
+    end = time.time()
+    print('Indexed in {:.2f}s, merged in {:.2f}s ({:.0f} instances/s)'
+          .format(indexed - start, end - indexed,
+                  len(merged) / (end - start)))
+
+    start = time.time()
+    out = io.StringIO()
+    for inst in merged:
+        out.write(json.dumps(inst))
+        out.write(',\n')
+    print('Serialized in {:.2f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
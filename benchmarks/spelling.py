@@ -0,0 +1,56 @@
+"""Spell-checking throughput of `SpellingValidator`.
+
+We time the loading of the Hunspell dictionaries (which happens on the first
+validation), then validations of generated sentences with an empty token
+cache (every distinct token goes to Hunspell) and with a warm one (as in a
+running worker), reported in sentences per second. Needs the `hunspell`
+package and the dictionaries in `spell/`.
+
+"""
+
+import time
+import argparse
+
+from common import setup_django, test_database
+from levenshtein import make_pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sentences', type=int, default=2000,
+                        help='number of sentences validated in each pass')
+    parser.add_argument('--language', default='english')
+    args = parser.parse_args()
+
+    setup_django()
+    from gists.validators import (SpellingValidator, get_hunspellers,
+                                  is_spelled_correctly)
+
+    sentences = [child for _, child in make_pairs(args.sentences, 100, 300,
+                                                  10)]
+    validator = SpellingValidator(args.language)
+
+    # The configuration, read by the validator, lives in the database
+    with test_database():
+        start = time.time()
+        get_hunspellers(args.language)
+        print('Dictionaries loaded in {:.2f}s'.format(time.time() - start))
+        # Load the tokenizer and nltk's models
+        validator(sentences[0])
+
+        for name in ('cold', 'warm'):
+            if name == 'cold':
+                is_spelled_correctly.cache_clear()
+            start = time.time()
+            for sentence in sentences:
+                validator(sentence)
+            elapsed = time.time() - start
+            print('{} token cache: {} sentences in {:.2f}s '
+                  '({:.0f} sentences/s)'.format(name, len(sentences),
+                                                elapsed,
+                                                len(sentences) / elapsed))
+        print(is_spelled_correctly.cache_info())
+
+
+if __name__ == '__main__':
+    main()
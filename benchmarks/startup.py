@@ -0,0 +1,140 @@
+"""Startup time of spreadr processes, with lazy or eager spell-checking.
+
+Each measurement runs in a fresh interpreter, timing `django.setup()` (which
+imports `gists.models`), `get_wsgi_application()`, the import of all the
+migrations (as `migrate` does) and `manage.py check`. With `--eager`,
+`SpellingValidator`s load their Hunspell dictionaries and tokenizer when
+they are instantiated, as they did before validation became lazy. Pass
+`--importtime` to also list the slowest imports of one process, from
+`python -X importtime`.
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from common import ROOT
+
+
+PHASES = ['setup', 'wsgi', 'migrations', 'check']
+
+
+def make_eager():
+    """Have SpellingValidator load everything on instantiation."""
+    from gists import validators
+    init = validators.SpellingValidator.__init__
+
+    def eager_init(self, language):
+        init(self, language)
+        validators.get_hunspellers(language)
+        self.tokenizer
+
+    validators.SpellingValidator.__init__ = eager_init
+
+
+def measure(eager):
+    """Time the startup phases in this process."""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spreadr.settings')
+    timings = {}
+
+    start = time.time()
+    if eager:
+        make_eager()
+    import django
+    django.setup()
+    timings['setup'] = time.time() - start
+
+    start = time.time()
+    from django.core.wsgi import get_wsgi_application
+    get_wsgi_application()
+    timings['wsgi'] = time.time() - start
+
+    start = time.time()
+    from django.db.migrations.loader import MigrationLoader
+    MigrationLoader(None, load=False).load_disk()
+    timings['migrations'] = time.time() - start
+
+    start = time.time()
+    from django.core.management import call_command
+    call_command('check', verbosity=0)
+    timings['check'] = time.time() - start
+
+    return timings
+
+
+def run_child(eager, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += [os.path.abspath(__file__), '--child']
+    if eager:
+        command.append('--eager')
+    result = subprocess.run(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        # e.g. hunspell missing in eager mode
+        sys.exit('Measurement failed:\n' + result.stderr[-2000:])
+    # `check` prints its verdict before our timings
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, n):
+    """Parse `-X importtime` output into the `n` slowest top-level
+    imports, by cumulated time."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Top-level imports aren't indented
+        if not name.startswith('  '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of processes started per mode')
+    parser.add_argument('--eager', action='store_true',
+                        help='also measure eager spell-checking setup')
+    parser.add_argument('--importtime', type=int, metavar='N', default=0,
+                        help='list the N slowest top-level imports')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.eager)))
+        return
+
+    for eager in ([False, True] if args.eager else [False]):
+        runs = [run_child(eager)[0] for _ in range(args.runs)]
+        print('{} spell-checking ({} runs, median):'
+              .format('Eager' if eager else 'Lazy', args.runs))
+        for phase in PHASES + ['total']:
+            if phase == 'total':
+                values = [sum(run.values()) for run in runs]
+            else:
+                values = [run[phase] for run in runs]
+            print('    {}: {:.0f} ms'.format(phase,
+                                            np.median(values) * 1000))
+
+        if args.importtime > 0:
+            _, stderr = run_child(eager, importtime=True)
+            print('    Slowest imports:')
+            for cumulative, name in slowest_imports(stderr,
+                                                    args.importtime):
+                print('        {}: {:.0f} ms'.format(name,
+                                                     cumulative / 1000))
+
+
+if __name__ == '__main__':
+    main()
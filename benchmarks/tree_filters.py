@@ -0,0 +1,98 @@
+"""Tree filters on a seeded database of 10k trees.
+
+Trees each have a root sentence, and every participant reformulated
+sentences in a random subset of them. We time the queries participants'
+requests make with the `profile` and `untouched_by_profile` filters (a count
+and a page of trees), and print the database's query plan for each filter.
+
+"""
+
+import time
+import random
+import argparse
+
+import numpy as np
+
+from common import setup_django, test_database, create_profiles, seed_trees
+
+
+EXPLAIN = {'sqlite': 'EXPLAIN QUERY PLAN ', 'mysql': 'EXPLAIN ',
+           'postgresql': 'EXPLAIN '}
+
+FILTERS = [
+    ('profile', lambda profile: {'profile': profile.pk}),
+    ('untouched_by_profile',
+     lambda profile: {'untouched_by_profile': profile.pk}),
+    ('participant', lambda profile: {'untouched_by_profile': profile.pk,
+                                     'root_bucket': 'experiment',
+                                     'without_other_mothertongue': 'true'}),
+]
+
+
+def seed_reformulations(profiles, pks, per_profile, seed=0):
+    """Have each profile reformulate the root of `per_profile` random trees
+    in `pks`."""
+    from gists.models import Sentence
+
+    rng = random.Random(seed)
+    roots = dict(Sentence.objects.filter(tree_as_root__isnull=False)
+                 .values_list('tree_id', 'pk'))
+    for profile in profiles:
+        Sentence.objects.bulk_create([
+            Sentence(tree_id=pk, profile=profile, parent_id=roots[pk],
+                     text='A reformulation for the benchmark.',
+                     read_time_proportion=.5, read_time_allotted=10,
+                     write_time_proportion=.5, write_time_allotted=20,
+                     language='english', bucket='experiment', depth=1)
+            for pk in rng.sample(pks, per_profile)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--trees', type=int, default=10000)
+    parser.add_argument('--profiles', type=int, default=100)
+    parser.add_argument('--reformulations', type=int, default=200,
+                        help='number of trees reformulated by each profile')
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from gists.filters import TreeFilter
+    from gists.models import Tree
+
+    with test_database():
+        author, = create_profiles(1, prefix='author')
+        pks = seed_trees(args.trees, author)
+        profiles = create_profiles(args.profiles)
+        seed_reformulations(profiles, pks, args.reformulations)
+        print('{} trees, {} profiles with {} reformulations each'
+              .format(args.trees, args.profiles, args.reformulations))
+
+        for name, params in FILTERS:
+            durations = []
+            for i in range(args.repeats):
+                profile = profiles[i % len(profiles)]
+                queryset = TreeFilter(params(profile),
+                                      queryset=Tree.objects.all()).qs
+                start = time.time()
+                queryset.count()
+                list(queryset.order_by('pk').values_list('pk', flat=True)
+                     [:10])
+                durations.append(time.time() - start)
+            durations = np.array(durations) * 1000
+            print('{}: p50 {:.1f} ms, max {:.1f} ms (count and one page)'
+                  .format(name, np.percentile(durations, 50),
+                          durations.max()))
+
+            if connection.vendor in EXPLAIN:
+                sql, sql_params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute(EXPLAIN[connection.vendor] + sql,
+                                   sql_params)
+                    for row in cursor.fetchall():
+                        print('    ' + ' | '.join(str(col) for col in row))
+
+
+if __name__ == '__main__':
+    main()
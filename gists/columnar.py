@@ -0,0 +1,112 @@
+"""Columnar storage of tables in NumPy files, for analysis.
+
+A table is a dict of equal-length columns. Numeric, boolean and datetime
+columns are plain NumPy arrays. String columns are `StringColumn`s, stored as
+the concatenated UTF-8 bytes of all values plus an array of offsets into
+those bytes (and a boolean mask of null values, if there are any), so that
+they too can be memory-mapped.
+
+A table is saved either as a directory holding one `.npy` file per array
+(which `load_table()` memory-maps, so nothing is read until it is used), or
+as a single compressed `.npz` file (smaller, but loaded in memory).
+
+This module does not depend on Django, so analysis scripts can use it
+without setting up spreadr.
+
+"""
+
+import os
+
+import numpy as np
+
+
+DATA_SUFFIX = '.data'
+OFFSETS_SUFFIX = '.offsets'
+NULLS_SUFFIX = '.nulls'
+
+
+class StringColumn:
+    """Column of strings backed by a bytes array, an offsets array, and
+    a mask of null values (None if the column has no nulls)."""
+
+    def __init__(self, data, offsets, nulls=None):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    @classmethod
+    def from_strings(cls, strings):
+        strings = list(strings)
+        nulls = np.array([s is None for s in strings], dtype=bool)
+        encoded = [(s or '').encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets, nulls if nulls.any() else None)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _arrays(table):
+    for name, column in table.items():
+        if isinstance(column, StringColumn):
+            yield name + DATA_SUFFIX, column.data
+            yield name + OFFSETS_SUFFIX, column.offsets
+            if column.nulls is not None:
+                yield name + NULLS_SUFFIX, column.nulls
+        else:
+            yield name, column
+
+
+def _table(arrays):
+    table = {}
+    for name, array in arrays.items():
+        if name.endswith(OFFSETS_SUFFIX) or name.endswith(NULLS_SUFFIX):
+            continue
+        if name.endswith(DATA_SUFFIX):
+            name = name[:-len(DATA_SUFFIX)]
+            table[name] = StringColumn(array, arrays[name + OFFSETS_SUFFIX],
+                                       arrays.get(name + NULLS_SUFFIX))
+        else:
+            table[name] = array
+    return table
+
+
+def save_table(path, table, compress=False):
+    """Save `table` to directory `path`, or to `path + '.npz'` if
+    `compress` is True."""
+    if compress:
+        np.savez_compressed(path, **dict(_arrays(table)))
+        return
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in _arrays(table):
+        np.save(os.path.join(path, name + '.npy'), array)
+
+
+def load_table(path, mmap_mode='r'):
+    """Load a table saved by `save_table()`, memory-mapping its columns if it
+    was saved as a directory."""
+    if path.endswith('.npz'):
+        with np.load(path) as npz:
+            return _table(dict(npz.items()))
+
+    arrays = {}
+    for filename in os.listdir(path):
+        if filename.endswith('.npy'):
+            arrays[filename[:-len('.npy')]] = np.load(
+                os.path.join(path, filename), mmap_mode=mmap_mode)
+    return _table(arrays)
@@ -0,0 +1,93 @@
+"""Immutable snapshots of the GistsConfiguration, shared by a whole request.
+
+`ConfigMiddleware` takes one snapshot per request, which `get_config()` then
+returns everywhere in that request, so hot paths read plain attributes
+instead of hitting the cache (and database) through `get_solo()`.
+
+Each process keeps its latest snapshot, and reloads it from the database
+when the configuration version (a key in `settings.CONFIG_CACHE`, set to the
+time of every save of the configuration) moves, or when the snapshot is
+older than `settings.CONFIG_SNAPSHOT_TIMEOUT` seconds. Only the latter
+reaches workers which don't share that cache.
+
+"""
+
+import time
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from gists.models import GistsConfiguration
+
+
+VERSION_KEY = 'gists:config:version'
+
+FIELDS = [field.attname
+          for field in GistsConfiguration._meta.concrete_fields]
+
+
+class ConfigSnapshot(namedtuple('ConfigSnapshot', FIELDS + ['version'])):
+    """Read-only copy of the GistsConfiguration fields and properties, and
+    of the configuration version it was loaded at (None if unknown)."""
+
+    __slots__ = ()
+
+    heartbeat_timeout = property(GistsConfiguration.heartbeat_timeout.fget)
+    tree_cost = property(GistsConfiguration.tree_cost.fget)
+
+    @classmethod
+    def from_instance(cls, instance, version):
+        return cls(*[getattr(instance, field) for field in FIELDS],
+                   version=version)
+
+
+# (version, load time, snapshot) of this process's latest snapshot
+_latest = None
+# Snapshot of the request being processed by the current thread
+_local = threading.local()
+
+
+def get_version():
+    return caches[settings.CONFIG_CACHE].get(VERSION_KEY)
+
+
+def bump_version():
+    """Have all processes reload their snapshot once the current transaction
+    is committed (so they can't reload the previous configuration)."""
+    transaction.on_commit(lambda: caches[settings.CONFIG_CACHE].set(
+        VERSION_KEY, time.time(), None))
+
+
+def load_config():
+    """Get this process's latest snapshot, reloading it if it is outdated."""
+    global _latest
+    version = get_version()
+    latest = _latest
+    if (latest is None or latest[0] != version
+            or time.time() - latest[1] > settings.CONFIG_SNAPSHOT_TIMEOUT):
+        # Fetched like get_solo() does, but without going through its cache
+        instance, _ = GistsConfiguration.objects.get_or_create(pk=1)
+        latest = _latest = (version, time.time(),
+                            ConfigSnapshot.from_instance(instance, version))
+    return latest[2]
+
+
+def get_config():
+    """Get the configuration snapshot of the current request, or a fresh
+    one outside of requests."""
+    config = getattr(_local, 'config', None)
+    return config if config is not None else load_config()
+
+
+class ConfigMiddleware:
+    """Take one configuration snapshot for each request."""
+
+    def process_request(self, request):
+        _local.config = load_config()
+
+    def process_response(self, request, response):
+        _local.config = None
+        return response
@@ -1,14 +1,26 @@
 import django_filters
 
-from gists.models import (Profile, Tree, LANGUAGE_CHOICES, OTHER_LANGUAGE,
+from gists.models import (Profile, Tree, Sentence, LANGUAGE_CHOICES,
                           BUCKET_CHOICES)
 
 
+def _no_sentence_exists(profile):
+    """SQL condition for the absence of sentences by `profile` in a tree, as
+    a correlated NOT EXISTS which uses the sentences' (profile, tree) index
+    instead of materializing the profile's trees."""
+    where = ('NOT EXISTS (SELECT 1 FROM {sentence} AS profile_sentence '
+             'WHERE profile_sentence.tree_id = {tree}.id '
+             'AND profile_sentence.profile_id = %s)'
+             .format(sentence=Sentence._meta.db_table,
+                     tree=Tree._meta.db_table))
+    return where, profile.pk
+
+
 class TreeFilter(django_filters.FilterSet):
     profile = django_filters.MethodFilter()
-    root_language = django_filters.ChoiceFilter(name='root__language',
+    root_language = django_filters.ChoiceFilter(name='root_language',
                                                 choices=LANGUAGE_CHOICES)
-    root_bucket = django_filters.ChoiceFilter(name='root__bucket',
+    root_bucket = django_filters.ChoiceFilter(name='root_bucket',
                                               choices=BUCKET_CHOICES)
     untouched_by_profile = django_filters.MethodFilter()
     with_other_mothertongue = django_filters.MethodFilter()
@@ -17,29 +29,33 @@ class TreeFilter(django_filters.FilterSet):
     def filter_profile(self, queryset, value):
         try:
             profile = Profile.objects.get(pk=value)
-            return queryset.filter(profiles=profile).distinct()
+            # Semi-join on the profile's sentences, found through the
+            # (profile, tree) index, so only the profile's trees are read
+            return queryset.filter(pk__in=Sentence.objects
+                                   .filter(profile=profile)
+                                   .values('tree'))
         except Profile.DoesNotExist:
             return queryset
 
     def filter_untouched_by_profile(self, queryset, value):
         try:
             profile = Profile.objects.get(pk=value)
-            return queryset.exclude(
-                pk__in=profile.trees.values_list('pk', flat=True))
+            where, param = _no_sentence_exists(profile)
+            return queryset.extra(where=[where], params=[param])
         except Profile.DoesNotExist:
             return queryset
 
     def filter_with_other_mothertongue(self, queryset, value):
         bvalue = value.lower() == 'true'
         if bvalue:
-            return queryset.filter(profiles__mothertongue=OTHER_LANGUAGE)
+            return queryset.filter(touched_by_other_mothertongue=True)
         else:
             return queryset
 
     def filter_without_other_mothertongue(self, queryset, value):
         bvalue = value.lower() == 'true'
         if bvalue:
-            return queryset.exclude(profiles__mothertongue=OTHER_LANGUAGE)
+            return queryset.filter(touched_by_other_mothertongue=False)
         else:
             return queryset
 
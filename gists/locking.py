@@ -0,0 +1,257 @@
+"""Allocation of tree locks to profiles.
+
+Tree locks are leases: a profile holds a tree for as long as it heartbeats it
+within the heartbeat timeout. Leases are kept by the backend set in
+`settings.LEASE_BACKEND`:
+
+* `DatabaseLeases` (the default) keeps them in the tree's `profile_lock` and
+  `profile_lock_heartbeat` columns. Leases are claimed with a single
+  conditional `UPDATE` on the one tree being claimed, so concurrent
+  participants never wait on each other's row locks: if two of them race for
+  the same tree, one update affects no rows and its caller simply moves on
+  to another candidate.
+* `CacheLeases` keeps them in the cache set in `settings.LEASE_CACHE`,
+  expiring after the heartbeat timeout, which moves most lock traffic off
+  the database: only claims, releases and one heartbeat every
+  `settings.LEASE_CHECKPOINT` seconds are written to the tree's lock columns
+  (so `profile_lock_heartbeat` lags behind the actual heartbeats). That cache
+  must be shared by all workers and have an atomic `add()` (memcached or
+  redis, not `LocMemCache` or `FileBasedCache`).
+
+"""
+
+import time
+from datetime import timedelta
+from contextlib import contextmanager
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from gists.models import Tree
+from gists.sampling import random_instance, pk_bounds
+
+
+# How many random candidates to try claiming before giving up
+CLAIM_ATTEMPTS = 5
+
+
+class DatabaseLeases:
+    """Leases kept in the trees' `profile_lock` columns."""
+
+    def free_trees(self, queryset, timeout):
+        """Filter `queryset` down to trees with no valid lease."""
+        return queryset.filter(Q(profile_lock__isnull=True)
+                               | Q(profile_lock_heartbeat__lt=now() - timeout))
+
+    def claim(self, pk, profile, timeout):
+        locked = now()
+        claimed = Tree.objects\
+            .filter(pk=pk)\
+            .filter(Q(profile_lock__isnull=True)
+                    | Q(profile_lock_heartbeat__lt=locked - timeout))\
+            .update(profile_lock=profile, profile_lock_heartbeat=locked)
+        return locked if claimed == 1 else None
+
+    def heartbeat(self, pk, profile, timeout):
+        beat = now()
+        refreshed = Tree.objects\
+            .filter(pk=pk, profile_lock=profile,
+                    profile_lock_heartbeat__gte=beat - timeout)\
+            .update(profile_lock_heartbeat=beat)
+        return refreshed == 1
+
+    def heartbeat_many(self, pks, profile, timeout):
+        beat = now()
+        with transaction.atomic():
+            # Lock the leases still held, so that they can't be claimed by
+            # anyone else before they are refreshed
+            held = set(Tree.objects
+                       .select_for_update()
+                       .filter(pk__in=pks, profile_lock=profile,
+                               profile_lock_heartbeat__gte=beat - timeout)
+                       .values_list('pk', flat=True))
+            Tree.objects.filter(pk__in=held)\
+                .update(profile_lock_heartbeat=beat)
+        return held
+
+    def release(self, pk):
+        Tree.objects.filter(pk=pk).update(profile_lock=None)
+
+
+class CacheLeases:
+    """Leases kept in a shared cache, expiring after the heartbeat timeout.
+
+    The cache holds each lease's owner, and each tree has a short-lived
+    mutex (taken with the cache's atomic `add()`) which makes reading and
+    changing its lease atomic. The tree's `profile_lock` is also set on
+    claim and cleared on release, and its `profile_lock_heartbeat` is only
+    saved every `settings.LEASE_CHECKPOINT` seconds, so that `free_trees()`
+    can still exclude held trees in SQL.
+
+    """
+
+    KEY = 'gists:lease:{}'
+    MUTEX_KEY = 'gists:lease:{}:mutex'
+    # Expiry of a tree's mutex, in case its holder dies while holding it
+    MUTEX_TIMEOUT = 5
+    # How many times, and how long (in seconds), to wait for a busy mutex
+    # when heartbeating
+    MUTEX_ATTEMPTS = 10
+    MUTEX_WAIT = .01
+
+    # Cache backends whose add() isn't atomic, with which two profiles could
+    # hold the same tree
+    UNSAFE_BACKENDS = (FileBasedCache, DummyCache)
+
+    def __init__(self):
+        self.cache = caches[settings.LEASE_CACHE]
+        if isinstance(self.cache, self.UNSAFE_BACKENDS):
+            raise ImproperlyConfigured(
+                "LEASE_CACHE '{}' has no atomic add(), which CacheLeases "
+                "needs: use memcached or redis".format(settings.LEASE_CACHE))
+        self.checkpoint = timedelta(seconds=settings.LEASE_CHECKPOINT)
+
+    @contextmanager
+    def mutex(self, pk, attempts=1):
+        """Hold the mutex of tree `pk`, yielding False if it stayed busy."""
+        key = self.MUTEX_KEY.format(pk)
+        for attempt in range(attempts):
+            if self.cache.add(key, True, self.MUTEX_TIMEOUT):
+                break
+            if attempt < attempts - 1:
+                time.sleep(self.MUTEX_WAIT)
+        else:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            self.cache.delete(key)
+
+    def free_trees(self, queryset, timeout):
+        # Heartbeats of held trees are at most one checkpoint old
+        cutoff = now() - timeout - self.checkpoint
+        return queryset.filter(Q(profile_lock__isnull=True)
+                               | Q(profile_lock_heartbeat__lt=cutoff))
+
+    def claim(self, pk, profile, timeout):
+        key = self.KEY.format(pk)
+        with self.mutex(pk) as acquired:
+            if not acquired or self.cache.get(key) is not None:
+                return None
+            locked = now()
+            self.cache.set(key, (profile.pk, locked), timeout.total_seconds())
+            Tree.objects.filter(pk=pk).update(profile_lock=profile,
+                                              profile_lock_heartbeat=locked)
+            return locked
+
+    def heartbeat(self, pk, profile, timeout):
+        key = self.KEY.format(pk)
+        with self.mutex(pk, self.MUTEX_ATTEMPTS) as acquired:
+            lease = self.cache.get(key) if acquired else None
+            if lease is None or lease[0] != profile.pk:
+                return False
+
+            beat = now()
+            checkpointed = lease[1]
+            if beat - checkpointed >= self.checkpoint:
+                Tree.objects.filter(pk=pk, profile_lock=profile)\
+                    .update(profile_lock_heartbeat=beat)
+                checkpointed = beat
+            self.cache.set(key, (profile.pk, checkpointed),
+                           timeout.total_seconds())
+            return True
+
+    def heartbeat_many(self, pks, profile, timeout):
+        return set(pk for pk in pks if self.heartbeat(pk, profile, timeout))
+
+    def release(self, pk):
+        with self.mutex(pk, self.MUTEX_ATTEMPTS):
+            self.cache.delete(self.KEY.format(pk))
+        Tree.objects.filter(pk=pk).update(profile_lock=None)
+
+
+_leases = None
+
+
+def get_leases():
+    """Get the (shared) instance of the lease backend set in the
+    settings."""
+    global _leases
+    if _leases is None:
+        _leases = import_string(settings.LEASE_BACKEND)()
+    return _leases
+
+
+def free_trees(queryset, timeout):
+    """Filter `queryset` down to trees with a root and no valid lock."""
+    return get_leases().free_trees(queryset.filter(sentences_count__gt=0),
+                                   timeout)
+
+
+def claim_tree(pk, profile, timeout):
+    """Atomically lock tree `pk` for `profile` if it is free.
+
+    Returns the time of the lock if it was obtained, None otherwise.
+
+    """
+    return get_leases().claim(pk, profile, timeout)
+
+
+def claim_random_tree(queryset, profile, timeout, attempts=CLAIM_ATTEMPTS):
+    """Lock a random free tree from `queryset` for `profile`.
+
+    Returns the locked tree (fetched with `queryset`), or None if no free
+    tree could be claimed.
+
+    """
+    bounds = pk_bounds(Tree)
+    for _ in range(attempts):
+        tree = random_instance(free_trees(queryset, timeout), bounds)
+        if tree is None:
+            # No free trees left
+            return None
+
+        locked = claim_tree(tree.pk, profile, timeout)
+        if locked is not None:
+            tree.profile_lock = profile
+            tree.profile_lock_heartbeat = locked
+            return tree
+
+    return None
+
+
+def heartbeat_tree(pk, profile, timeout):
+    """Refresh the lock of `profile` on tree `pk`, if it still holds it.
+
+    Returns True if the lock was refreshed.
+
+    """
+    return get_leases().heartbeat(pk, profile, timeout)
+
+
+def heartbeat_trees(pks, profile, timeout):
+    """Refresh the locks of `profile` on all trees in `pks` it still holds,
+    at once.
+
+    Returns the set of pks of the trees whose lock was refreshed.
+
+    """
+    return get_leases().heartbeat_many(pks, profile, timeout)
+
+
+def release_tree(tree):
+    """Release any lock on `tree`, e.g. once a sentence was added to it."""
+    get_leases().release(tree.pk)
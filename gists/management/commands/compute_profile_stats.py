@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gists.models import ProfileStats, ProfileBucketCounts
+
+
+class Command(BaseCommand):
+    help = ('Recompute the running per-profile aggregates used by the '
+            'statistics endpoint, and the per-profile contribution counters')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ProfileStats.compute()
+            ProfileBucketCounts.compute()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Computed the stats of {} profiles'
+            .format(ProfileStats.objects.count())))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gists.models import Tree
+
+
+class Command(BaseCommand):
+    help = ('Recompute the materialized shape metrics of all trees '
+            '(sentences count, branches count, branch depths) and their '
+            'root and participation attributes')
+
+    def handle(self, *args, **options):
+        trees = Tree.objects.order_by('pk')
+        n_trees = trees.count()
+
+        for i, tree in enumerate(trees.iterator()):
+            with transaction.atomic():
+                tree.compute_shape()
+                tree.compute_participation()
+            if (i + 1) % 100 == 0:
+                self.stdout.write('{}/{} trees'.format(i + 1, n_trees))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Computed the shape of {} trees'.format(n_trees)))
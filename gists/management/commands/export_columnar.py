@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from gists.columnar import StringColumn, save_table
+from gists.models import Sentence, Tree, Profile
+
+
+# Tables to export, with the fields of each (following relations with '__')
+TABLES = [
+    ('sentences', Sentence,
+     ['id', 'created', 'tree', 'profile', 'parent', 'tree_as_root', 'text',
+      'read_time_proportion', 'read_time_allotted', 'write_time_proportion',
+      'write_time_allotted', 'language', 'bucket', 'depth', 'head',
+      'branch_depth', 'parent_errs']),
+    ('trees', Tree,
+     ['id', 'created', 'profile_lock', 'profile_lock_heartbeat',
+      'sentences_count', 'branches_count', 'shortest_branch_depth',
+      'root_language', 'root_bucket', 'touched_by_other_mothertongue']),
+    ('profiles', Profile,
+     ['id', 'created', 'user', 'user__username', 'mothertongue',
+      'trained_reformulations', 'prolific_id', 'word_span__span',
+      'word_span__score']),
+]
+
+
+def field_for(model, path):
+    names = path.split('__')
+    for name in names[:-1]:
+        model = model._meta.get_field(name).related_model
+    return model._meta.get_field(names[-1])
+
+
+def column(field, values):
+    """Convert `values` of `field` to a column, encoding nulls as -1 for
+    integers, NaN for floats, NaT for datetimes, and in the null mask of
+    strings. Booleans can't be null."""
+    if isinstance(field, (models.CharField, models.TextField)):
+        return StringColumn.from_strings(values)
+    if isinstance(field, models.BooleanField):
+        return np.array(values, dtype=bool)
+    if isinstance(field, models.FloatField):
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=np.float64)
+    if isinstance(field, models.DateTimeField):
+        return np.array([np.datetime64('NaT') if v is None
+                         else np.datetime64(v.replace(tzinfo=None), 'us')
+                         for v in values], dtype='datetime64[us]')
+    # Integers, primary and foreign keys
+    return np.array([-1 if v is None else v for v in values], dtype=np.int64)
+
+
+class Command(BaseCommand):
+    help = ('Export sentences, trees and profiles to columnar NumPy files, '
+            'loadable (and memory-mappable) with gists.columnar.load_table')
+
+    def add_arguments(self, parser):
+        parser.add_argument('outdir',
+                            help='directory in which to write the tables')
+        parser.add_argument('--compress', action='store_true',
+                            help='write one compressed .npz file per table, '
+                            'which cannot be memory-mapped')
+
+    def handle(self, *args, **options):
+        outdir = options['outdir']
+        if os.path.exists(outdir):
+            raise CommandError("'{}' already exists, not overwriting it"
+                               .format(outdir))
+        os.makedirs(outdir)
+
+        for name, model, paths in TABLES:
+            rows = model.objects.order_by('pk').values_list(*paths)
+            values = list(zip(*rows.iterator())) or [()] * len(paths)
+            table = dict((path, column(field_for(model, path), vals))
+                         for path, vals in zip(paths, values))
+            save_table(os.path.join(outdir, name), table,
+                       compress=options['compress'])
+            self.stdout.write('{}: {} rows'.format(name, len(values[0])))
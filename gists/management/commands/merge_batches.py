@@ -0,0 +1,173 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.migrations.recorder import MigrationRecorder
+
+from merge_dbs import Merger
+
+
+# Models that already have their single instance in a freshly migrated
+# database, and which we therefore save instead of bulk-creating
+SINGLETONS = ('sites.site', 'gists.gistsconfiguration')
+
+
+def add_database(alias, name):
+    """Configure a connection `alias` to database `name` on the same server
+    and with the same credentials as the default database."""
+    default = connections.databases[DEFAULT_DB_ALIAS]
+    connections.databases[alias] = dict(default, NAME=name)
+    connections.ensure_defaults(alias)
+
+
+@contextmanager
+def keep_auto_now_add(model):
+    """Let `model`'s auto_now_add fields keep the values we give them."""
+    fields = [field for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class DatabaseMerger(Merger):
+    """Merger reading instances directly from the batch databases."""
+
+    def __init__(self, aliases, chunk_size, state=None):
+        self.dbs = aliases
+        self.chunk_size = chunk_size
+        self._init_state(state)
+
+    def _check_dbs(self):
+        # All batches must have the same schema as the target database
+        target = MigrationRecorder(connections[DEFAULT_DB_ALIAS])\
+            .applied_migrations()
+        for alias in self.dbs:
+            applied = MigrationRecorder(connections[alias])\
+                .applied_migrations()
+            if applied != target:
+                raise CommandError("Database '{}' has different migrations "
+                                   "applied than the target database"
+                                   .format(connections[alias]
+                                           .settings_dict['NAME']))
+
+    def _db_instances(self, alias, name):
+        model = apps.get_model(name)
+        fields = [field for field in dict(self.MODELS)[name]
+                  if not model._meta.get_field(field).many_to_many]
+
+        # Walk the table by pk ranges, so that only one chunk of rows is in
+        # memory at a time whatever the database driver does with cursors
+        last_pk = 0
+        while True:
+            rows = list(model.objects.using(alias)
+                        .filter(pk__gt=last_pk)
+                        .order_by('pk')
+                        .values('pk', *fields)[:self.chunk_size])
+            for row in rows:
+                pk = row.pop('pk')
+                yield {'model': name, 'pk': pk, 'fields': row}
+            if len(rows) < self.chunk_size:
+                return
+            last_pk = rows[-1]['pk']
+
+
+class Command(BaseCommand):
+    help = ('Merge batch databases of an experiment directly into the '
+            '(freshly migrated) default database, without going through '
+            'json dumps')
+
+    def add_arguments(self, parser):
+        parser.add_argument('batches', metavar='DB_NAME', nargs='+',
+                            help='name of a batch database to merge')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of rows read and inserted at once')
+        parser.add_argument('--state', metavar='STATE_FILE',
+                            help='json file holding the state of the merge; '
+                            'if it exists, the batches are appended to the '
+                            'previously merged ones; it is then updated with '
+                            'the new state')
+
+    def handle(self, *args, **options):
+        state = None
+        if options['state'] is not None and os.path.exists(options['state']):
+            with open(options['state']) as state_file:
+                state = json.load(state_file)
+
+        if (state is None
+                and apps.get_model('gists.sentence').objects.exists()):
+            raise CommandError("The target database already has sentences, "
+                               "merge batches into an empty database or "
+                               "append to it using its merge state file")
+
+        aliases = []
+        for i, name in enumerate(options['batches']):
+            alias = 'batch_{}'.format(i)
+            add_database(alias, name)
+            aliases.append(alias)
+
+        merger = DatabaseMerger(aliases, options['batch_size'], state)
+        with transaction.atomic():
+            self.write(merger.merge_dbs(), options['batch_size'])
+
+        if options['state'] is not None:
+            with open(options['state'], 'w') as state_file:
+                json.dump(merger.get_state(), state_file)
+
+    def write(self, instances, batch_size):
+        current = None
+        objs = []
+        count = 0
+        start = time.time()
+
+        for inst in instances:
+            if inst['model'] != current:
+                self.flush(current, objs)
+                self.report(current, count, start)
+                current = inst['model']
+                model = apps.get_model(current)
+                attnames = dict((field.name, field.attname)
+                                for field in model._meta.concrete_fields)
+                objs = []
+                count = 0
+                start = time.time()
+
+            fields = dict((attnames[name], value)
+                          for name, value in inst['fields'].items())
+            objs.append(model(pk=inst['pk'], **fields))
+            count += 1
+            if len(objs) >= batch_size:
+                self.flush(current, objs)
+                objs = []
+
+        self.flush(current, objs)
+        self.report(current, count, start)
+
+    def flush(self, name, objs):
+        if len(objs) == 0:
+            return
+
+        model = apps.get_model(name)
+        if name in SINGLETONS:
+            for obj in objs:
+                obj.save()
+        else:
+            with keep_auto_now_add(model):
+                model.objects.bulk_create(objs)
+
+    def report(self, name, count, start):
+        if name is None:
+            return
+
+        duration = time.time() - start
+        self.stdout.write('{}: {} rows in {:.1f}s ({:.0f} rows/s)'
+                          .format(name, count, duration,
+                                  count / duration if duration > 0 else 0))
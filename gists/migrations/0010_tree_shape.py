@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-10 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Shape computation as of this migration, on historical models
+
+def shape_from_parent(parent):
+    if parent is None:
+        return {'depth': 0, 'head_id': None, 'branch_depth': 0}
+    if parent.parent_id is None:
+        return {'depth': 1, 'head_id': None, 'branch_depth': 1}
+    return {'depth': parent.depth + 1,
+            'head_id': parent.head_id or parent.pk,
+            'branch_depth': 0}
+
+
+def compute_tree_shape(tree, Sentence):
+    sentences = list(Sentence.objects.filter(tree=tree).order_by('pk'))
+    by_pk = dict((s.pk, s) for s in sentences)
+    children = {}
+    for sentence in sentences:
+        children.setdefault(sentence.parent_id, []).append(sentence)
+
+    # Breadth-first from the root, so parents come before their children
+    walk = list(children.get(None, []))
+    for sentence in walk:
+        walk.extend(children.get(sentence.pk, []))
+        shape = shape_from_parent(by_pk.get(sentence.parent_id))
+        sentence.depth = shape['depth']
+        sentence.head_id = shape['head_id']
+        sentence.branch_depth = shape['branch_depth']
+        if sentence.head_id is not None:
+            head = by_pk[sentence.head_id]
+            head.branch_depth = max(head.branch_depth, sentence.depth)
+
+    for sentence in sentences:
+        Sentence.objects.filter(pk=sentence.pk).update(
+            depth=sentence.depth, head=sentence.head_id,
+            branch_depth=sentence.branch_depth)
+
+    branch_depths = [s.branch_depth for s in sentences if s.depth == 1]
+    tree.sentences_count = len(sentences)
+    tree.branches_count = len(branch_depths)
+    tree.shortest_branch_depth = min(branch_depths or [0])
+    tree.save(update_fields=['sentences_count', 'branches_count',
+                             'shortest_branch_depth'])
+
+
+def compute_tree_shapes(apps, schema_editor):
+    Tree = apps.get_model('gists', 'Tree')
+    Sentence = apps.get_model('gists', 'Sentence')
+    for tree in Tree.objects.order_by('pk').iterator():
+        compute_tree_shape(tree, Sentence)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0009_auto_20170303_1826'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentence',
+            name='branch_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sentence',
+            name='depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sentence',
+            name='head',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='branch_sentences', to='gists.Sentence'),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='branches_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='sentences_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='shortest_branch_depth',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(compute_tree_shapes, migrations.RunPython.noop),
+    ]
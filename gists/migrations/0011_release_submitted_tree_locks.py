@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import F, Max
+
+
+def release_submitted_tree_locks(apps, schema_editor):
+    # Locks used to be implicitly released by adding a sentence to the tree
+    # after the last heartbeat. They are now explicitly released on sentence
+    # creation, so clear the locks that were implicitly released.
+    Tree = apps.get_model('gists', 'Tree')
+    pks = Tree.objects\
+        .filter(profile_lock__isnull=False)\
+        .annotate(last_sentence=Max('sentences__created'))\
+        .filter(last_sentence__gt=F('profile_lock_heartbeat'))\
+        .values_list('pk', flat=True)
+    Tree.objects.filter(pk__in=list(pks)).update(profile_lock=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0010_tree_shape'),
+    ]
+
+    operations = [
+        migrations.RunPython(release_submitted_tree_locks,
+                             migrations.RunPython.noop),
+    ]
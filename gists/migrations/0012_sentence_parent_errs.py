@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-12 15:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0011_release_submitted_tree_locks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentence',
+            name='parent_errs',
+            field=models.FloatField(null=True),
+        ),
+    ]
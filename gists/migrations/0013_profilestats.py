@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-14 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from gists.utils import fast_levenshtein
+
+
+# Stats computation as of this migration, on historical models
+
+def fill_parent_errs(Sentence):
+    texts = (Sentence.objects
+             .filter(parent__isnull=False, parent_errs__isnull=True)
+             .values_list('pk', 'text', 'parent__text'))
+    for pk, text, parent_text in texts:
+        Sentence.objects.filter(pk=pk).update(
+            parent_errs=fast_levenshtein(parent_text, text)
+            / len(parent_text))
+
+
+def compute_profiles_stats(apps, schema_editor):
+    ProfileStats = apps.get_model('gists', 'ProfileStats')
+    Sentence = apps.get_model('gists', 'Sentence')
+    WordSpan = apps.get_model('gists', 'WordSpan')
+
+    fill_parent_errs(Sentence)
+    sums = Sentence.objects.filter(
+        parent__isnull=False).values('profile').annotate(
+        count=models.Count('pk'),
+        errs=models.Sum('parent_errs'),
+        read=models.Sum('read_time_proportion'),
+        write=models.Sum('write_time_proportion')).order_by()
+    spans = dict(WordSpan.objects.values_list('profile', 'span'))
+
+    ProfileStats.objects.all().delete()
+    ProfileStats.objects.bulk_create(
+        [ProfileStats(profile_id=profile_sums['profile'],
+                      reformulations_count=profile_sums['count'],
+                      errs_sum=profile_sums['errs'],
+                      read_time_proportion_sum=profile_sums['read'],
+                      write_time_proportion_sum=profile_sums['write'],
+                      word_span=spans.pop(profile_sums['profile'], None))
+         for profile_sums in sums]
+        + [ProfileStats(profile_id=profile, word_span=span)
+           for profile, span in spans.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0012_sentence_parent_errs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reformulations_count', models.PositiveIntegerField(default=0)),
+                ('errs_sum', models.FloatField(default=0)),
+                ('read_time_proportion_sum', models.FloatField(default=0)),
+                ('write_time_proportion_sum', models.FloatField(default=0)),
+                ('word_span', models.PositiveSmallIntegerField(null=True)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='gists.Profile')),
+            ],
+        ),
+        migrations.RunPython(compute_profiles_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-17 16:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Counts computation as of this migration, on historical models
+
+BUCKETS = ['experiment', 'game', 'training']
+
+
+def bucket_count_aggregates(bucket_field, counted, prefix, **conditions):
+    aggregates = {}
+    for bucket in BUCKETS:
+        lookups = dict(conditions)
+        lookups[bucket_field] = bucket
+        aggregates[prefix + bucket] = models.Count(
+            models.Case(models.When(then=counted, **lookups),
+                        output_field=models.IntegerField()),
+            distinct=True)
+    return aggregates
+
+
+def compute_profiles_bucket_counts(apps, schema_editor):
+    ProfileBucketCounts = apps.get_model('gists', 'ProfileBucketCounts')
+    Profile = apps.get_model('gists', 'Profile')
+
+    aggregates = {}
+    aggregates.update(bucket_count_aggregates(
+        'sentences__bucket', 'sentences', 'sentences_'))
+    aggregates.update(bucket_count_aggregates(
+        'sentences__bucket', 'sentences', 'reformulations_',
+        sentences__parent__isnull=False))
+    aggregates.update(bucket_count_aggregates(
+        'sentences__tree__root__bucket', 'sentences__tree', 'trees_'))
+
+    counts = []
+    for profile in Profile.objects.annotate(**aggregates):
+        for bucket in BUCKETS:
+            counts.append(ProfileBucketCounts(
+                profile_id=profile.pk, bucket=bucket,
+                sentences_count=getattr(profile, 'sentences_' + bucket),
+                reformulations_count=getattr(
+                    profile, 'reformulations_' + bucket),
+                trees_count=getattr(profile, 'trees_' + bucket)))
+
+    ProfileBucketCounts.objects.all().delete()
+    ProfileBucketCounts.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0013_profilestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileBucketCounts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(choices=[('experiment', 'Experiment'), ('game', 'Game'), ('training', 'Training')], max_length=100)),
+                ('sentences_count', models.PositiveIntegerField(default=0)),
+                ('reformulations_count', models.PositiveIntegerField(default=0)),
+                ('trees_count', models.PositiveIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bucket_counts', to='gists.Profile')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='profilebucketcounts',
+            unique_together=set([('profile', 'bucket')]),
+        ),
+        migrations.RunPython(compute_profiles_bucket_counts,
+                             migrations.RunPython.noop),
+    ]
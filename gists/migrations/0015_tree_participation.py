@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-20 09:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Participation computation as of this migration, on historical models
+
+def compute_tree_participations(apps, schema_editor):
+    Tree = apps.get_model('gists', 'Tree')
+    Sentence = apps.get_model('gists', 'Sentence')
+    for tree in Tree.objects.order_by('pk').iterator():
+        root = Sentence.objects.filter(tree_as_root=tree).first()
+        tree.root_language = root.language if root is not None else None
+        tree.root_bucket = root.bucket if root is not None else None
+        tree.touched_by_other_mothertongue = Sentence.objects\
+            .filter(tree=tree, profile__mothertongue='other').exists()
+        tree.save(update_fields=['root_language', 'root_bucket',
+                                 'touched_by_other_mothertongue'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0014_profilebucketcounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='root_bucket',
+            field=models.CharField(choices=[('experiment', 'Experiment'), ('game', 'Game'), ('training', 'Training')], max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='root_language',
+            field=models.CharField(choices=[('english', 'English'), ('other', 'Other')], max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='touched_by_other_mothertongue',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='tree',
+            index_together=set([('root_language', 'touched_by_other_mothertongue', 'root_bucket')]),
+        ),
+        migrations.RunPython(compute_tree_participations,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-21 14:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0015_tree_participation'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='sentence',
+            index_together=set([('profile', 'tree')]),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2017-03-22 11:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_has_root(apps, schema_editor):
+    Tree = apps.get_model('gists', 'Tree')
+    Tree.objects.filter(root__isnull=False).update(has_root=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gists', '0016_sentence_profile_tree_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='has_root',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.RunPython(set_has_root, migrations.RunPython.noop),
+    ]
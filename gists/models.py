@@ -1,20 +1,21 @@
 import re
 from datetime import timedelta, datetime
+from functools import lru_cache
 try:
     from django.utils.timezone import now
 except ImportError:
     now = datetime.now
 
-from django.db import models
+from django.db import models, connection
 from django.core.validators import (MinValueValidator, MaxValueValidator,
                                     MinLengthValidator)
 from django.conf import settings
-import networkx as nx
+from django.utils.functional import cached_property
 import numpy as np
 from numpy.random import shuffle
 
 from solo.models import SingletonModel
-from .utils import memoize, levenshtein
+from .utils import fast_levenshtein, levenshtein_batch
 from .validators import SpellingValidator, PunctuationValidator
 
 
@@ -67,6 +68,161 @@ JOB_TYPE_CHOICES = [
 ]
 
 
+def bucket_count_aggregates(bucket_field, counted='pk', prefix='',
+                            **conditions):
+    """Aggregates counting, for each bucket, the distinct `counted` values of
+    rows whose `bucket_field` is that bucket (and which match the extra
+    lookups in `conditions`).
+
+    Pass them to `aggregate()` or `annotate()` to get all bucket counts in a
+    single query; the results are named `prefix + bucket`.
+
+    """
+    aggregates = {}
+    for bucket, _ in BUCKET_CHOICES:
+        lookups = dict(conditions)
+        lookups[bucket_field] = bucket
+        aggregates[prefix + bucket] = models.Count(
+            models.Case(models.When(then=counted, **lookups),
+                        output_field=models.IntegerField()),
+            distinct=True)
+    return aggregates
+
+
+# The following functions recompute materialized fields from scratch, for the
+# models' methods and the management commands (the data migrations which
+# backfilled these fields keep their own frozen copies).
+
+
+def shape_from_parent(parent):
+    """Shape fields for a new sentence reformulating `parent`."""
+    if parent is None:
+        return {'depth': 0, 'head_id': None, 'branch_depth': 0}
+    if parent.parent_id is None:
+        # New branch head
+        return {'depth': 1, 'head_id': None, 'branch_depth': 1}
+    return {'depth': parent.depth + 1,
+            'head_id': parent.head_id or parent.pk,
+            'branch_depth': 0}
+
+
+def compute_tree_shape(tree, sentence_model):
+    """Recompute all shape fields of `tree` and its sentences, and save
+    them."""
+    sentences = list(tree.sentences.order_by('pk'))
+    by_pk = dict((s.pk, s) for s in sentences)
+    children = {}
+    for sentence in sentences:
+        children.setdefault(sentence.parent_id, []).append(sentence)
+
+    # Walk the tree breadth-first from its root, so that each parent's shape
+    # is known before we reach its children (their pks can be in any order,
+    # e.g. after merging databases)
+    walk = list(children.get(None, []))
+    for sentence in walk:
+        walk.extend(children.get(sentence.pk, []))
+        parent = by_pk.get(sentence.parent_id)
+        shape = shape_from_parent(parent)
+        sentence.depth = shape['depth']
+        sentence.head_id = shape['head_id']
+        sentence.branch_depth = shape['branch_depth']
+        if sentence.head_id is not None:
+            head = by_pk[sentence.head_id]
+            head.branch_depth = max(head.branch_depth, sentence.depth)
+
+    for sentence in sentences:
+        sentence_model.objects.filter(pk=sentence.pk).update(
+            depth=sentence.depth, head=sentence.head_id,
+            branch_depth=sentence.branch_depth)
+
+    branch_depths = [s.branch_depth for s in sentences if s.depth == 1]
+    tree.sentences_count = len(sentences)
+    tree.branches_count = len(branch_depths)
+    tree.shortest_branch_depth = min(branch_depths or [0])
+    tree.save(update_fields=['sentences_count', 'branches_count',
+                             'shortest_branch_depth'])
+
+
+def compute_tree_participation(tree, sentence_model):
+    """Recompute the root and participation attributes of `tree`, and save
+    them."""
+    root = sentence_model.objects.filter(tree_as_root=tree).first()
+    tree.root_language = root.language if root is not None else None
+    tree.root_bucket = root.bucket if root is not None else None
+    tree.touched_by_other_mothertongue = tree.sentences\
+        .filter(profile__mothertongue=OTHER_LANGUAGE).exists()
+    tree.save(update_fields=['root_language', 'root_bucket',
+                             'touched_by_other_mothertongue'])
+
+
+def fill_parent_errs(sentence_model):
+    """Compute and save `parent_errs` for sentences which lack it."""
+    texts = list(sentence_model.objects
+                 .filter(parent__isnull=False, parent_errs__isnull=True)
+                 .values('pk', 'text', 'parent__text'))
+    distances = levenshtein_batch([(item['parent__text'], item['text'])
+                                   for item in texts])
+
+    for item, distance in zip(texts, distances):
+        sentence_model.objects.filter(pk=item['pk']).update(
+            parent_errs=distance / len(item['parent__text']))
+
+
+def compute_profile_stats(stats_model, sentence_model, word_span_model):
+    """Recompute all profiles' aggregates (see `ProfileStats`)."""
+    fill_parent_errs(sentence_model)
+    sums = sentence_model.objects.filter(
+        parent__isnull=False).values('profile').annotate(
+        count=models.Count('pk'),
+        errs=models.Sum('parent_errs'),
+        read=models.Sum('read_time_proportion'),
+        write=models.Sum('write_time_proportion')).order_by()
+    spans = dict(word_span_model.objects.values_list('profile', 'span'))
+
+    stats_model.objects.all().delete()
+    stats_model.objects.bulk_create(
+        [stats_model(profile_id=profile_sums['profile'],
+                     reformulations_count=profile_sums['count'],
+                     errs_sum=profile_sums['errs'],
+                     read_time_proportion_sum=profile_sums['read'],
+                     write_time_proportion_sum=profile_sums['write'],
+                     word_span=spans.pop(profile_sums['profile'], None))
+         for profile_sums in sums]
+        + [stats_model(profile_id=profile, word_span=span)
+           for profile, span in spans.items()])
+
+
+def with_bucket_counts(queryset):
+    """Annotate the profiles of `queryset` with their bucket counts (see
+    `Profile.with_bucket_counts()`)."""
+    aggregates = {}
+    aggregates.update(bucket_count_aggregates(
+        'sentences__bucket', counted='sentences', prefix='sentences_'))
+    aggregates.update(bucket_count_aggregates(
+        'sentences__bucket', counted='sentences',
+        prefix='reformulations_', sentences__parent__isnull=False))
+    aggregates.update(bucket_count_aggregates(
+        'sentences__tree__root__bucket', counted='sentences__tree',
+        prefix='trees_'))
+    return queryset.annotate(**aggregates)
+
+
+def compute_profile_bucket_counts(counts_model, profile_model):
+    """Recompute all profiles' counters (see `ProfileBucketCounts`)."""
+    counts = []
+    for profile in with_bucket_counts(profile_model.objects.all()):
+        for bucket, _ in BUCKET_CHOICES:
+            counts.append(counts_model(
+                profile_id=profile.pk, bucket=bucket,
+                sentences_count=getattr(profile, 'sentences_' + bucket),
+                reformulations_count=getattr(
+                    profile, 'reformulations_' + bucket),
+                trees_count=getattr(profile, 'trees_' + bucket)))
+
+    counts_model.objects.all().delete()
+    counts_model.objects.bulk_create(counts)
+
+
 class GistsConfiguration(SingletonModel):
     target_branch_depth = models.PositiveIntegerField(
         default=settings.DEFAULT_TARGET_BRANCH_DEPTH,
@@ -116,6 +272,11 @@ class GistsConfiguration(SingletonModel):
     def tree_cost(self):
         return self.target_branch_count * self.target_branch_depth
 
+    def save(self, *args, **kwargs):
+        from gists.config import bump_version
+        super(GistsConfiguration, self).save(*args, **kwargs)
+        bump_version()
+
     def __unicode__(self):
         return "Gists Configuration"
 
@@ -141,57 +302,38 @@ class Sentence(models.Model):
     language = models.CharField(choices=LANGUAGE_CHOICES, max_length=100)
     bucket = models.CharField(choices=BUCKET_CHOICES, max_length=100)
 
-    levenshtein = memoize(levenshtein)
+    # Materialized shape of the tree around this sentence: `depth` is the
+    # distance to the root (0 for the root), `head` is the root child
+    # heading the branch this sentence is in (null for the root and for the
+    # branch heads themselves), and `branch_depth` is the depth of the
+    # deepest sentence in the branch (only maintained on branch heads).
+    depth = models.PositiveIntegerField(default=0)
+    head = models.ForeignKey('Sentence', related_name='branch_sentences',
+                             null=True)
+    branch_depth = models.PositiveIntegerField(default=0)
 
-    class Meta:
-        ordering = ('-created',)
+    # Levenshtein distance to the parent, normalized by the parent's length.
+    # Computed on creation, or lazily by `fill_parent_errs()`.
+    parent_errs = models.FloatField(null=True)
 
-    @classmethod
-    def bucket_counts(cls, queryset):
-        return dict((bucket[0], queryset.filter(bucket=bucket[0]).count())
-                    for bucket in BUCKET_CHOICES)
-
-    @classmethod
-    def mean_read_time_proportion_per_profile(cls):
-        profiles_means = Sentence.objects.filter(
-            parent__isnull=False).values('profile').annotate(
-            mean=models.Avg('read_time_proportion')).order_by()
+    levenshtein = lru_cache(maxsize=4096)(fast_levenshtein)
 
-        means = {}
-        for profile_mean in profiles_means:
-            means[profile_mean['profile']] = profile_mean['mean']
-
-        return means
+    class Meta:
+        ordering = ('-created',)
+        index_together = [
+            ('profile', 'tree'),
+        ]
 
     @classmethod
-    def mean_write_time_proportion_per_profile(cls):
-        profiles_means = Sentence.objects.filter(
-            parent__isnull=False).values('profile').annotate(
-            mean=models.Avg('write_time_proportion')).order_by()
-
-        means = {}
-        for profile_mean in profiles_means:
-            means[profile_mean['profile']] = profile_mean['mean']
-
-        return means
+    def shape_from_parent(cls, parent):
+        return shape_from_parent(parent)
 
     @classmethod
-    def mean_errs_per_profile(cls):
-        texts = Sentence.objects.filter(
-            parent__isnull=False).values('profile', 'text', 'parent__text')
-
-        errs = {}
-        for item in texts:
-            profile = item['profile']
-            if profile not in errs:
-                errs[profile] = []
-            distance = cls.levenshtein(item['parent__text'], item['text'])
-            errs[profile].append(distance / len(item['parent__text']))
-
-        for profile, pErrs in errs.items():
-            errs[profile] = np.mean(pErrs)
-
-        return errs
+    def parent_errs_for(cls, parent, text):
+        """Normalized distance from `parent` to a reformulation `text`."""
+        if parent is None:
+            return None
+        return cls.levenshtein(parent.text, text) / len(parent.text)
 
     @property
     def read_time_used(self):
@@ -221,37 +363,110 @@ class Tree(models.Model):
                                       through_fields=('tree', 'profile'),
                                       related_name='trees')
 
+    # Materialized shape metrics, kept up to date by `add_to_shape()`
+    sentences_count = models.PositiveIntegerField(default=0, db_index=True)
+    branches_count = models.PositiveIntegerField(default=0, db_index=True)
+    shortest_branch_depth = models.PositiveIntegerField(default=0,
+                                                        db_index=True)
+
+    # Materialized root and participation attributes, kept up to date by
+    # `add_to_participation()`
+    root_language = models.CharField(choices=LANGUAGE_CHOICES,
+                                     max_length=100, null=True)
+    root_bucket = models.CharField(choices=BUCKET_CHOICES, max_length=100,
+                                   null=True)
+    touched_by_other_mothertongue = models.BooleanField(default=False)
+    # Set when the tree is claimed for a new root sentence, see
+    # `SentenceViewSet.obtain_empty_tree()`
+    has_root = models.BooleanField(default=False, db_index=True)
+
     SPACES = re.compile(' +')
 
+    class Meta:
+        index_together = [
+            ('root_language', 'touched_by_other_mothertongue', 'root_bucket'),
+        ]
+
     @classmethod
     def bucket_counts(cls, queryset):
-        return dict((bucket[0],
-                     queryset.filter(root__bucket=bucket[0]).count())
-                    for bucket in BUCKET_CHOICES)
+        return queryset.aggregate(**bucket_count_aggregates('root_bucket'))
 
     @property
     def network_edges(self):
-        edges = self.sentences.values('pk', 'children')
-        return [{'source': e['pk'], 'target': e['children']} for e in edges
-                if e['pk'] is not None and e['children'] is not None]
-
-    @property
-    def shortest_branch_depth(self):
-        # No root or nothing but root? Return fast
-        if self.sentences.count() <= 1:
-            return 0
-
-        heads = self.root.children.values_list('pk', flat=True)
-        edges = [(e['source'], e['target']) for e in self.network_edges]
-        graph = nx.DiGraph(edges)
-        all_depths = [nx.single_source_shortest_path_length(graph, h)
-                      for h in heads]
-        branch_depths = [1 + max(depths.values()) for depths in all_depths]
-        return min(branch_depths)
+        # Iterate over all() (and not values()) to use prefetched sentences
+        return [{'source': s.parent_id, 'target': s.pk}
+                for s in self.sentences.all() if s.parent_id is not None]
+
+    def add_to_shape(self, sentence):
+        """Update the shape metrics after `sentence` was added to the tree.
+
+        `sentence` must already hold its own shape fields (see
+        `Sentence.shape_from_parent()`).
+
+        """
+        Tree.objects.filter(pk=self.pk)\
+            .update(sentences_count=models.F('sentences_count') + 1)
+
+        if sentence.depth == 1:
+            Tree.objects.filter(pk=self.pk)\
+                .update(branches_count=models.F('branches_count') + 1)
+        elif sentence.depth > 1:
+            Sentence.objects\
+                .filter(pk=sentence.head_id,
+                        branch_depth__lt=sentence.depth)\
+                .update(branch_depth=sentence.depth)
+
+        if sentence.depth > 0:
+            # Computed inside the UPDATE, which reads the latest committed
+            # branch depths instead of this transaction's snapshot (under
+            # REPEATABLE READ), so concurrent additions aren't missed
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'UPDATE {tree} SET shortest_branch_depth = COALESCE(('
+                    'SELECT MIN(branch_depth) FROM {sentence} '
+                    'WHERE tree_id = %s AND depth = 1), 0) WHERE id = %s'
+                    .format(tree=Tree._meta.db_table,
+                            sentence=Sentence._meta.db_table),
+                    [self.pk, self.pk])
+
+        self.refresh_from_db(fields=['sentences_count', 'branches_count',
+                                     'shortest_branch_depth'])
+
+    def compute_shape(self):
+        """Recompute all shape fields of the tree and its sentences from
+        scratch, and save them."""
+        compute_tree_shape(self, Sentence)
+
+    def add_to_participation(self, sentence):
+        """Update the root and participation attributes after `sentence` was
+        added to the tree."""
+        updates = {}
+        if sentence.parent_id is None:
+            updates['root_language'] = sentence.language
+            updates['root_bucket'] = sentence.bucket
+        if sentence.profile.mothertongue == OTHER_LANGUAGE:
+            updates['touched_by_other_mothertongue'] = True
+
+        if len(updates) > 0:
+            Tree.objects.filter(pk=self.pk).update(**updates)
+            for name, value in updates.items():
+                setattr(self, name, value)
+
+    def compute_participation(self):
+        """Recompute the root and participation attributes from scratch, and
+        save them."""
+        compute_tree_participation(self, Sentence)
+        self.has_root = self.root_language is not None
+        self.save(update_fields=['has_root'])
 
-    @property
-    def distinct_profiles(self):
-        return self.profiles.distinct().order_by()
+    @classmethod
+    def update_mothertongue_participation(cls, profile):
+        """Recompute `touched_by_other_mothertongue` on the trees `profile`
+        participated in, after its mothertongue changed."""
+        trees = cls.objects.filter(pk__in=profile.sentences.values('tree'))
+        other = {'sentences__profile__mothertongue': OTHER_LANGUAGE}
+        trees.filter(**other).update(touched_by_other_mothertongue=True)
+        trees.exclude(**other).update(touched_by_other_mothertongue=False)
 
 
 class Profile(models.Model):
@@ -268,40 +483,168 @@ class Profile(models.Model):
 
     prolific_id = models.CharField(max_length=50, null=True)
 
-    @classmethod
-    def word_spans(cls):
-        spans = np.array(Profile.objects
-                         .filter(word_span__isnull=False)
-                         .values_list('word_span__span', flat=True))
-        shuffle(spans)
-        return spans
-
     @property
     def distinct_trees(self):
         return self.trees.distinct().order_by()
 
+    @classmethod
+    def with_bucket_counts(cls, queryset):
+        """Annotate the profiles of `queryset` with their counts of sentences,
+        reformulations, and trees participated in (by root bucket), per
+        bucket, in a single query. Annotations are named
+        `sentences_<bucket>`, `reformulations_<bucket>` and
+        `trees_<bucket>`."""
+        return with_bucket_counts(queryset)
+
+    @cached_property
+    def counts(self):
+        """Contribution counts per bucket: sentences, reformulations, and
+        trees participated in (by root bucket), read from the profile's
+        `bucket_counts` in a single (possibly prefetched) query."""
+        counts = dict((kind, dict((bucket[0], 0)
+                                  for bucket in BUCKET_CHOICES))
+                      for kind in ['sentences', 'reformulations', 'trees'])
+        for bucket_counts in self.bucket_counts.all():
+            bucket = bucket_counts.bucket
+            counts['sentences'][bucket] = bucket_counts.sentences_count
+            counts['reformulations'][bucket] = \
+                bucket_counts.reformulations_count
+            counts['trees'][bucket] = bucket_counts.trees_count
+        return counts
+
     @property
     def suggestion_credit(self):
-        config = GistsConfiguration.get_solo()
+        from .config import get_config
+        config = get_config()
         base = config.base_credit
         cost = config.tree_cost
 
-        n_created = self.sentences.filter(parent=None).count()
-        n_transformed = self.sentences.count() - n_created
+        n_transformed = sum(self.counts['reformulations'].values())
+        n_created = sum(self.counts['sentences'].values()) - n_transformed
 
         return base + (n_transformed // cost) - n_created
 
     @property
     def next_credit_in(self):
-        config = GistsConfiguration.get_solo()
+        from .config import get_config
+        config = get_config()
         cost = config.tree_cost
 
-        n_created = self.sentences.filter(parent=None).count()
-        n_transformed = self.sentences.count() - n_created
+        n_transformed = sum(self.counts['reformulations'].values())
 
         return cost - (n_transformed % cost)
 
 
+class ProfileBucketCounts(models.Model):
+    """Counters of a profile's contributions in a bucket."""
+
+    profile = models.ForeignKey('Profile', related_name='bucket_counts')
+    bucket = models.CharField(choices=BUCKET_CHOICES, max_length=100)
+
+    sentences_count = models.PositiveIntegerField(default=0)
+    reformulations_count = models.PositiveIntegerField(default=0)
+    # Trees the profile participated in, counted in their root's bucket
+    trees_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('profile', 'bucket')
+
+    @classmethod
+    def _increment(cls, profile_id, bucket, **increments):
+        counts, _ = cls.objects.get_or_create(profile_id=profile_id,
+                                              bucket=bucket)
+        cls.objects.filter(pk=counts.pk).update(**dict(
+            (name, models.F(name) + increment)
+            for name, increment in increments.items()))
+
+    @classmethod
+    def add_sentence(cls, sentence):
+        is_reformulation = sentence.parent_id is not None
+        cls._increment(sentence.profile_id, sentence.bucket,
+                       sentences_count=1,
+                       reformulations_count=int(is_reformulation))
+
+        is_new_tree = not Sentence.objects\
+            .filter(tree_id=sentence.tree_id, profile_id=sentence.profile_id)\
+            .exclude(pk=sentence.pk)\
+            .exists()
+        if is_new_tree:
+            root_bucket = (Sentence.objects
+                           .filter(tree_as_root_id=sentence.tree_id)
+                           .values_list('bucket', flat=True).get()
+                           if is_reformulation else sentence.bucket)
+            cls._increment(sentence.profile_id, root_bucket, trees_count=1)
+
+    @classmethod
+    def compute(cls):
+        """Recompute all profiles' counters from scratch."""
+        compute_profile_bucket_counts(cls, Profile)
+
+
+class ProfileStats(models.Model):
+    """Running aggregates over a profile's reformulations, for `/stats/`."""
+
+    profile = models.OneToOneField('Profile', related_name='stats')
+
+    reformulations_count = models.PositiveIntegerField(default=0)
+    errs_sum = models.FloatField(default=0)
+    read_time_proportion_sum = models.FloatField(default=0)
+    write_time_proportion_sum = models.FloatField(default=0)
+    word_span = models.PositiveSmallIntegerField(null=True)
+
+    @classmethod
+    def add_sentence(cls, sentence):
+        # Only reformulations are aggregated
+        if sentence.parent_id is None:
+            return
+
+        F = models.F
+        stats, _ = cls.objects.get_or_create(profile_id=sentence.profile_id)
+        cls.objects.filter(pk=stats.pk).update(
+            reformulations_count=F('reformulations_count') + 1,
+            errs_sum=F('errs_sum') + sentence.parent_errs,
+            read_time_proportion_sum=F('read_time_proportion_sum')
+            + sentence.read_time_proportion,
+            write_time_proportion_sum=F('write_time_proportion_sum')
+            + sentence.write_time_proportion)
+
+    @classmethod
+    def add_word_span(cls, word_span):
+        cls.objects.update_or_create(profile_id=word_span.profile_id,
+                                     defaults={'word_span': word_span.span})
+
+    @classmethod
+    def compute(cls):
+        """Recompute all profiles' aggregates from scratch."""
+        compute_profile_stats(cls, Sentence, WordSpan)
+
+    @classmethod
+    def means_per_profile(cls):
+        """Per-profile means of errs, read and write time proportions."""
+        means = {
+            'mean_errs_per_profile': {},
+            'mean_read_time_proportion_per_profile': {},
+            'mean_write_time_proportion_per_profile': {},
+        }
+        for stats in cls.objects.filter(reformulations_count__gt=0):
+            count = stats.reformulations_count
+            means['mean_errs_per_profile'][stats.profile_id] = \
+                stats.errs_sum / count
+            means['mean_read_time_proportion_per_profile'][
+                stats.profile_id] = stats.read_time_proportion_sum / count
+            means['mean_write_time_proportion_per_profile'][
+                stats.profile_id] = stats.write_time_proportion_sum / count
+        return means
+
+    @classmethod
+    def word_spans(cls):
+        spans = np.array(cls.objects
+                         .filter(word_span__isnull=False)
+                         .values_list('word_span', flat=True))
+        shuffle(spans)
+        return spans
+
+
 class Questionnaire(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     profile = models.OneToOneField('Profile')
@@ -0,0 +1,60 @@
+"""Random sampling of model instances inside the database.
+
+Instead of pulling all matching pks into Python to choose one, we probe
+random pks between the bounds of the model's table and keep the first which
+matches the queryset. Every pk in the range is drawn with the same
+probability and non-matching ones are rejected, so every matching instance
+is drawn with the same probability, and each probe is a single lookup in
+the primary key index: as long as the matching instances are a sizeable
+fraction of the pk range, drawing one costs a few indexed queries whatever
+the size of the table.
+
+When the matching instances are too sparse for the probes to find one, we
+fall back to counting them and fetching the one at a random offset, which is
+also uniform but scans all matching instances (twice).
+
+"""
+
+from django.db.models import Min, Max
+from numpy.random import randint
+
+
+# Number of random pks probed before falling back to count and offset, which
+# finds an instance with high probability if at least a tenth of the pk
+# range matches
+PROBES = 20
+
+
+def pk_bounds(model):
+    """Smallest and largest pks of `model`'s table, read from the primary key
+    index (None if the table is empty)."""
+    bounds = model._default_manager.aggregate(low=Min('pk'), high=Max('pk'))
+    return bounds['low'], bounds['high']
+
+
+def random_instance(queryset, bounds=None, probes=PROBES):
+    """Draw a random instance from `queryset`, or None if it is empty.
+
+    Pass the `pk_bounds()` of the model as `bounds` to avoid reading them
+    again when drawing repeatedly.
+
+    """
+    low, high = bounds if bounds is not None else pk_bounds(queryset.model)
+    if low is None:
+        return None
+
+    for _ in range(probes):
+        pk = int(randint(low, high + 1))
+        instance = queryset.filter(pk=pk).first()
+        if instance is not None:
+            return instance
+
+    # Too few matching instances, count them instead (in O(matching))
+    count = queryset.count()
+    if count == 0:
+        return None
+    queryset = queryset.order_by('pk')
+    index = int(randint(count))
+    instances = list(queryset[index:index + 1])
+    # The queryset may have shrunk since it was counted
+    return instances[0] if len(instances) > 0 else queryset.last()
@@ -75,17 +75,12 @@ class TreeSerializer(serializers.ModelSerializer):
         many=True,
         read_only=True
     )
-    sentences_count = serializers.ReadOnlyField(
-        source='sentences.count'
-    )
-    profiles = serializers.PrimaryKeyRelatedField(
-        source='distinct_profiles',
-        many=True,
-        read_only=True
-    )
-    branches_count = serializers.ReadOnlyField(
-        source='root.children.count'
-    )
+    profiles = serializers.SerializerMethodField()
+
+    def get_profiles(self, obj):
+        # Read profiles from the (usually prefetched) sentences instead of
+        # querying the distinct profiles of each tree
+        return sorted(set(s.profile_id for s in obj.sentences.all()))
 
     class Meta:
         model = Tree
@@ -102,8 +97,9 @@ class TreeSerializer(serializers.ModelSerializer):
         )
         read_only_fields = (
             'profile_lock_heartbeat',
+            'sentences_count',
             'network_edges',
-            'shortest_branch_depth',
+            'branches_count', 'shortest_branch_depth',
         )
 
 
@@ -171,13 +167,13 @@ class ProfileSerializer(serializers.ModelSerializer):
                 obj.word_span is not None)
 
     def get_sentences_counts(self, obj):
-        return Sentence.bucket_counts(obj.sentences)
+        return obj.counts['sentences']
 
     def get_reformulations_counts(self, obj):
-        return Sentence.bucket_counts(obj.sentences.exclude(parent=None))
+        return obj.counts['reformulations']
 
     def get_trees_counts(self, obj):
-        return Tree.bucket_counts(obj.distinct_trees)
+        return obj.counts['trees']
 
     def get_available_trees_counts(self, obj):
         """Other- and mothertongue-aware count of available trees, per bucket.
@@ -204,19 +200,16 @@ class ProfileSerializer(serializers.ModelSerializer):
         if language == OTHER_LANGUAGE:
             # Count trees in DEFAULT_LANGUAGE,
             # touched by profiles in OTHER_LANGUAGE
-            qs = Tree.objects\
-                .filter(root__language=DEFAULT_LANGUAGE)\
-                .filter(profiles__mothertongue=OTHER_LANGUAGE)\
-                .exclude(pk__in=obj.trees.values_list('pk', flat=True))
+            qs = Tree.objects.filter(root_language=DEFAULT_LANGUAGE,
+                                     touched_by_other_mothertongue=True)
         else:
             # Count trees in the profile's language,
             # untouched by profiles in OTHER_LANGUAGE
-            qs = Tree.objects\
-                .filter(root__language=language)\
-                .exclude(profiles__mothertongue=OTHER_LANGUAGE)\
-                .exclude(pk__in=obj.trees.values_list('pk', flat=True))
+            qs = Tree.objects.filter(root_language=language,
+                                     touched_by_other_mothertongue=False)
 
-        return Tree.bucket_counts(qs)
+        # Leave out the profile's own trees
+        return Tree.bucket_counts(qs.exclude(sentences__profile=obj))
 
     class Meta:
         model = Profile
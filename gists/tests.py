@@ -1,3 +1,673 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import timedelta
+from collections import Counter
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import (TestCase, TransactionTestCase, RequestFactory,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from numpy import random
+from rest_framework.test import APITestCase
+
+from gists import config
+from gists.columnar import StringColumn, save_table, load_table
+from gists.filters import TreeFilter
+from gists.locking import CacheLeases
+from gists.models import (Tree, Sentence, Profile, ProfileBucketCounts,
+                          GistsConfiguration, BUCKET_CHOICES,
+                          bucket_count_aggregates)
+from gists.sampling import random_instance
+from gists.utils import (levenshtein, bitparallel_levenshtein,
+                         levenshtein_batch)
+from gists.views import TreeViewSet, Stats, Meta
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+def create_profile(username, mothertongue='english', **kwargs):
+    user = User.objects.create_user(username, password='pass', **kwargs)
+    return Profile.objects.create(user=user, mothertongue=mothertongue)
+
+
+def create_sentence(tree, profile, parent=None, bucket='experiment',
+                    text='A sentence for the tests.'):
+    """Create a sentence like `SentenceViewSet.perform_create()` does,
+    keeping the tree's materialized attributes up to date."""
+    sentence = Sentence.objects.create(
+        tree=tree, profile=profile, parent=parent,
+        tree_as_root=tree if parent is None else None, text=text,
+        read_time_proportion=.5, read_time_allotted=10,
+        write_time_proportion=.5, write_time_allotted=20,
+        language='english', bucket=bucket,
+        **Sentence.shape_from_parent(parent))
+    tree.add_to_shape(sentence)
+    tree.add_to_participation(sentence)
+    return sentence
+
+
+class RandomInstanceTestCase(TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(random_instance(Tree.objects.all()))
+
+    def test_uniform_after_gap(self):
+        # 10 training trees followed by a long run of experiment trees,
+        # which must not make the first training tree more likely
+        training = [Tree.objects.create(root_bucket='training').pk
+                    for _ in range(10)]
+        Tree.objects.bulk_create([Tree(root_bucket='experiment')
+                                  for _ in range(190)])
+
+        random.seed(0)
+        queryset = Tree.objects.filter(root_bucket='training')
+        draws = Counter(random_instance(queryset).pk for _ in range(1000))
+
+        self.assertEqual(set(draws), set(training))
+        for pk in training:
+            self.assertTrue(50 <= draws[pk] <= 150, draws)
+
+    def test_dense_probes(self):
+        Tree.objects.bulk_create([Tree() for _ in range(100)])
+        # The pk bounds and one probe, which can't miss
+        with self.assertNumQueries(2):
+            self.assertIsNotNone(random_instance(Tree.objects.all()))
+
+
+class TreeShapeTestCase(TestCase):
+
+    def test_add_to_shape(self):
+        alice = create_profile('alice')
+        tree = Tree.objects.create()
+        root = create_sentence(tree, alice)
+        self.assertEqual(tree.shortest_branch_depth, 0)
+        first = create_sentence(tree, alice, parent=root)
+        create_sentence(tree, alice, parent=first)
+        self.assertEqual(tree.shortest_branch_depth, 2)
+        second = create_sentence(tree, alice, parent=root)
+        self.assertEqual((tree.sentences_count, tree.branches_count,
+                          tree.shortest_branch_depth), (4, 2, 1))
+        create_sentence(tree, alice, parent=second)
+        self.assertEqual(tree.shortest_branch_depth, 2)
+
+        # Same as recomputing from scratch
+        shape = (tree.sentences_count, tree.branches_count,
+                 tree.shortest_branch_depth)
+        tree.compute_shape()
+        tree.refresh_from_db()
+        self.assertEqual((tree.sentences_count, tree.branches_count,
+                          tree.shortest_branch_depth), shape)
+
+    def test_compute_shape_unordered_pks(self):
+        # Children with lower pks than their parents, as after a merge
+        alice = create_profile('alice')
+        tree = Tree.objects.create()
+
+        def create(pk, parent):
+            return Sentence.objects.create(
+                pk=pk, tree=tree, profile=alice, parent=parent,
+                tree_as_root=tree if parent is None else None,
+                text='A sentence for the tests.',
+                read_time_proportion=.5, read_time_allotted=10,
+                write_time_proportion=.5, write_time_allotted=20,
+                language='english', bucket='experiment')
+
+        create(5, create(10, create(50, None)))
+
+        tree.compute_shape()
+        shapes = Sentence.objects.order_by('pk')\
+            .values_list('pk', 'depth', 'head', 'branch_depth')
+        self.assertEqual(list(shapes), [(5, 2, 10, 0), (10, 1, None, 2),
+                                        (50, 0, None, 0)])
+        tree.refresh_from_db()
+        self.assertEqual((tree.sentences_count, tree.branches_count,
+                          tree.shortest_branch_depth), (3, 1, 2))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheLeasesTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.leases = CacheLeases()
+        self.timeout = timedelta(seconds=20)
+        self.alice = create_profile('alice')
+        self.bob = create_profile('bob')
+        self.tree = Tree.objects.create(sentences_count=1)
+
+    def test_claim(self):
+        self.assertIsNotNone(
+            self.leases.claim(self.tree.pk, self.alice, self.timeout))
+        self.assertIsNone(
+            self.leases.claim(self.tree.pk, self.bob, self.timeout))
+
+        # The lock is visible in the database, which excludes the tree
+        self.tree.refresh_from_db()
+        self.assertEqual(self.tree.profile_lock, self.alice)
+        self.assertFalse(self.leases.free_trees(Tree.objects.all(),
+                                                self.timeout).exists())
+
+        self.leases.release(self.tree.pk)
+        self.tree.refresh_from_db()
+        self.assertIsNone(self.tree.profile_lock)
+        self.assertTrue(self.leases.free_trees(Tree.objects.all(),
+                                               self.timeout).exists())
+
+    def test_heartbeat(self):
+        self.leases.claim(self.tree.pk, self.alice, self.timeout)
+        self.assertTrue(
+            self.leases.heartbeat(self.tree.pk, self.alice, self.timeout))
+        self.assertFalse(
+            self.leases.heartbeat(self.tree.pk, self.bob, self.timeout))
+
+    def test_heartbeat_after_takeover(self):
+        self.leases.claim(self.tree.pk, self.alice, self.timeout)
+        # Alice's lease expires and Bob claims the tree
+        cache.delete(CacheLeases.KEY.format(self.tree.pk))
+        self.leases.claim(self.tree.pk, self.bob, self.timeout)
+
+        self.assertFalse(
+            self.leases.heartbeat(self.tree.pk, self.alice, self.timeout))
+        self.assertTrue(
+            self.leases.heartbeat(self.tree.pk, self.bob, self.timeout))
+
+    def test_busy_mutex(self):
+        with self.leases.mutex(self.tree.pk):
+            self.assertIsNone(
+                self.leases.claim(self.tree.pk, self.alice, self.timeout))
+
+    def test_unsafe_cache(self):
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': '/tmp/spreadr-tests-cache',
+        }}
+        with override_settings(CACHES=caches):
+            with self.assertRaises(ImproperlyConfigured):
+                CacheLeases()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TreeExportTestCase(APITestCase):
+
+    def test_export(self):
+        admin = create_profile('admin', is_staff=True)
+        trees = [Tree.objects.create() for _ in range(5)]
+        for tree in trees[1:]:
+            root = create_sentence(tree, admin)
+            create_sentence(tree, admin, parent=root)
+
+        self.client.login(username='admin', password='pass')
+        # Export in several chunks
+        with mock.patch.object(TreeViewSet, 'EXPORT_CHUNK_SIZE', 2):
+            response = self.client.get('/api/trees/export/')
+            lines = b''.join(response.streaming_content).splitlines()
+
+        exported = [json.loads(line.decode()) for line in lines]
+        # The first tree has no sentences
+        self.assertEqual([tree['id'] for tree in exported],
+                         [tree.pk for tree in trees[1:]])
+        for tree in exported:
+            self.assertEqual(len(tree['sentences']), 2)
+            self.assertEqual(tree['network_edges'],
+                             [{'source': tree['sentences'][0]['id'],
+                               'target': tree['sentences'][1]['id']}])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ListQueriesTestCase(APITestCase):
+    """Listing trees or sentences takes the same number of queries whatever
+    the number of items listed."""
+
+    def setUp(self):
+        self.alice = create_profile('alice')
+        self.bob = create_profile('bob', mothertongue='other')
+
+    def create_tree(self):
+        tree = Tree.objects.create()
+        root = create_sentence(tree, self.alice)
+        child = create_sentence(tree, self.bob, parent=root)
+        create_sentence(tree, self.alice, parent=child)
+        create_sentence(tree, self.bob, parent=root)
+        return tree
+
+    def assertConstantQueries(self, url, add_items):
+        add_items(1)
+        # Warm up the per-process configuration snapshot
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as one:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        add_items(9)
+        with self.assertNumQueries(len(one)):
+            response = self.client.get(url + '?page_size=100')
+        self.assertGreater(response.data['count'], 1)
+
+    def test_trees(self):
+        self.assertConstantQueries(
+            '/api/trees/',
+            lambda n: [self.create_tree() for _ in range(n)])
+
+    def test_sentences(self):
+        self.assertConstantQueries(
+            '/api/sentences/',
+            lambda n: [self.create_tree() for _ in range(n)])
+
+
+class TreeFilterTestCase(TestCase):
+
+    def setUp(self):
+        self.alice = create_profile('alice')
+        self.bob = create_profile('bob', mothertongue='other')
+
+        self.by_alice = Tree.objects.create()
+        root = create_sentence(self.by_alice, self.alice)
+        create_sentence(self.by_alice, self.alice, parent=root)
+        self.by_both = Tree.objects.create()
+        root = create_sentence(self.by_both, self.alice)
+        create_sentence(self.by_both, self.bob, parent=root)
+        create_sentence(self.by_both, self.alice, parent=root)
+        self.by_bob = Tree.objects.create()
+        create_sentence(self.by_bob, self.bob)
+        self.empty = Tree.objects.create()
+
+    def filter(self, **params):
+        return TreeFilter(params, queryset=Tree.objects.order_by('pk')).qs
+
+    def assertTrees(self, queryset, trees):
+        # Compare lists to catch duplicates
+        self.assertEqual(list(queryset), trees)
+
+    def test_profile(self):
+        self.assertTrees(self.filter(profile=self.alice.pk),
+                         [self.by_alice, self.by_both])
+        self.assertTrees(self.filter(untouched_by_profile=self.alice.pk),
+                         [self.by_bob, self.empty])
+        self.assertTrees(self.filter(profile=self.bob.pk,
+                                     untouched_by_profile=self.alice.pk),
+                         [self.by_bob])
+
+    def test_mothertongue(self):
+        self.assertTrees(self.filter(with_other_mothertongue='true'),
+                         [self.by_both, self.by_bob])
+        self.assertTrees(self.filter(without_other_mothertongue='true'),
+                         [self.by_alice, self.empty])
+
+    def test_profile_sql(self):
+        # A semi-join on the profile's sentences
+        sql = str(self.filter(profile=self.alice.pk).query)
+        self.assertIn('IN (SELECT', sql)
+        self.assertNotIn('EXISTS', sql)
+        self.assertNotIn('JOIN', sql)
+        # A correlated NOT EXISTS
+        sql = str(self.filter(untouched_by_profile=self.alice.pk).query)
+        self.assertIn('NOT EXISTS (SELECT 1', sql)
+        self.assertNotIn('IN (SELECT', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def plan(self, **params):
+        sql, sql_params = self.filter(**params).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, sql_params)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    @skipUnless(connection.vendor == 'sqlite', 'sqlite query plans')
+    def test_profile_plan(self):
+        # The profile's sentences are found in the (profile, tree) index of
+        # sentences, and their trees by pk, without scanning all trees
+        plan = self.plan(profile=self.alice.pk)
+        self.assertIn('(profile_id=?)', plan)
+        self.assertIn('PRIMARY KEY', plan)
+        self.assertNotIn('SCAN', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'sqlite query plans')
+    def test_untouched_by_profile_plan(self):
+        # Each tree is checked with one lookup in the (profile, tree) index
+        # of sentences, instead of materializing all the profile's trees
+        plan = self.plan(untouched_by_profile=self.alice.pk)
+        self.assertIn('CORRELATED', plan)
+        self.assertIn('(profile_id=? AND tree_id=?)', plan)
+
+
+class BucketCountAggregatesTestCase(TestCase):
+
+    def setUp(self):
+        self.alice = create_profile('alice')
+        self.bob = create_profile('bob')
+        tree = Tree.objects.create()
+        root = create_sentence(tree, self.alice)
+        child = create_sentence(tree, self.bob, parent=root, bucket='game')
+        create_sentence(tree, self.alice, parent=child)
+        create_sentence(tree, self.bob, parent=child)
+        tree = Tree.objects.create()
+        root = create_sentence(tree, self.bob, bucket='training')
+        create_sentence(tree, self.alice, parent=root, bucket='training')
+        create_sentence(tree, self.alice, parent=root, bucket='game')
+
+    def test_duplicated_join(self):
+        aggregates = {}
+        aggregates.update(bucket_count_aggregates(
+            'sentences__bucket', counted='sentences', prefix='sentences_'))
+        aggregates.update(bucket_count_aggregates(
+            'sentences__bucket', counted='sentences',
+            prefix='reformulations_', sentences__parent__isnull=False))
+        aggregates.update(bucket_count_aggregates(
+            'sentences__tree__root__bucket', counted='sentences__tree',
+            prefix='trees_'))
+        # Joining the other sentences of each tree repeats every row
+        profiles = Profile.objects.annotate(
+            rows=Count('sentences__tree__sentences'), **aggregates)
+
+        for profile in profiles:
+            sentences = Sentence.objects.filter(profile=profile)
+            self.assertGreater(profile.rows, sentences.count())
+            for bucket, _ in BUCKET_CHOICES:
+                self.assertEqual(
+                    getattr(profile, 'sentences_' + bucket),
+                    sentences.filter(bucket=bucket).count())
+                self.assertEqual(
+                    getattr(profile, 'reformulations_' + bucket),
+                    sentences.filter(bucket=bucket,
+                                     parent__isnull=False).count())
+                self.assertEqual(
+                    getattr(profile, 'trees_' + bucket),
+                    Tree.objects.filter(sentences__profile=profile,
+                                        root__bucket=bucket)
+                    .distinct().count())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SentenceCreationTestCase(APITestCase):
+
+    def setUp(self):
+        # Skip spell-checking, and reload the configuration to see it
+        GistsConfiguration.objects.create(jabberwocky_mode=True)
+        config._latest = None
+        self.alice = create_profile('alice', is_staff=True)
+        self.bob = create_profile('bob', is_staff=True)
+
+    def post_sentence(self, profile, parent=None, bucket='experiment'):
+        self.client.login(username=profile.user.username, password='pass')
+        response = self.client.post('/api/sentences/', {
+            'parent': parent.pk if parent is not None else None,
+            'text': 'Some words to reformulate.', 'language': 'english',
+            'bucket': bucket,
+            'read_time_proportion': .5, 'read_time_allotted': 10,
+            'write_time_proportion': .5, 'write_time_allotted': 20,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Sentence.objects.get(pk=response.data['id'])
+
+    def bucket_counts(self):
+        return set(ProfileBucketCounts.objects
+                   .exclude(sentences_count=0, trees_count=0)
+                   .values_list('profile', 'bucket', 'sentences_count',
+                                'reformulations_count', 'trees_count'))
+
+    def test_bucket_counts(self):
+        experiment = self.post_sentence(self.alice)
+        child = self.post_sentence(self.bob, parent=experiment)
+        self.post_sentence(self.bob, parent=child)
+        self.post_sentence(self.alice, parent=child)
+        training = self.post_sentence(self.bob, bucket='training')
+        # Reformulations in another bucket than their tree's root
+        self.post_sentence(self.alice, parent=training, bucket='game')
+        self.post_sentence(self.alice, parent=training, bucket='game')
+
+        incremented = self.bucket_counts()
+        ProfileBucketCounts.compute()
+        self.assertEqual(incremented, self.bucket_counts())
+        self.assertIn((self.alice.pk, 'game', 2, 2, 0), incremented)
+        self.assertIn((self.alice.pk, 'training', 0, 0, 1), incremented)
+
+    def test_claim_empty_tree(self):
+        empty = Tree.objects.create()
+        filter = Tree.objects.filter
+
+        def stale_filter(*args, **kwargs):
+            if kwargs == {'has_root': False}:
+                # Candidates read before any of the claims
+                return filter(pk=empty.pk)
+            return filter(*args, **kwargs)
+
+        with mock.patch.object(Tree.objects, 'filter',
+                               side_effect=stale_filter):
+            first = self.post_sentence(self.alice)
+            second = self.post_sentence(self.bob)
+
+        self.assertEqual(first.tree, empty)
+        self.assertNotEqual(second.tree, empty)
+        self.assertEqual(second.tree.root, second)
+
+    def test_heartbeat_after_submission(self):
+        root = self.post_sentence(self.bob)
+        Tree.objects.filter(pk=root.tree_id)\
+            .update(profile_lock=self.alice, profile_lock_heartbeat=now())
+        self.post_sentence(self.alice, parent=root)
+
+        url = '/api/trees/{}/heartbeat/'.format(root.tree_id)
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['locked'])
+        # Profiles which didn't just submit to it still can't heartbeat it
+        create_profile('carol')
+        self.client.login(username='carol', password='pass')
+        self.assertEqual(self.client.put(url).status_code, 403)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConfigSnapshotTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        config._latest = None
+        self.configuration = GistsConfiguration.objects.create(
+            target_branch_depth=4)
+
+    def set_depth(self, depth):
+        self.configuration.target_branch_depth = depth
+        self.configuration.save()
+
+    def test_request(self):
+        middleware = config.ConfigMiddleware()
+        request = RequestFactory().get('/api/meta/')
+        middleware.process_request(request)
+        snapshot = config.get_config()
+        self.set_depth(5)
+        self.assertIs(config.get_config(), snapshot)
+        middleware.process_response(request, None)
+        self.assertEqual(config.get_config().target_branch_depth, 5)
+
+    def test_on_commit(self):
+        self.assertEqual(config.get_config().target_branch_depth, 4)
+        with transaction.atomic():
+            self.set_depth(5)
+            self.assertEqual(config.get_config().target_branch_depth, 4)
+        self.assertEqual(config.get_config().target_branch_depth, 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetaTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        config._latest = None
+        Meta._rendered = None
+
+    def test_etag(self):
+        response = self.client.get('/api/meta/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get('/api/meta/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        configuration = GistsConfiguration.get_solo()
+        configuration.target_branch_depth += 1
+        configuration.save()
+        response = self.client.get('/api/meta/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content.decode())
+                         ['target_branch_depth'],
+                         configuration.target_branch_depth)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StatsTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.stale = {'updated': now() - 2 * Stats.COOLDOWN_PERIOD}
+        cache.set(Stats.CACHE_KEY, self.stale, None)
+
+    @mock.patch.object(Stats, 'update')
+    @mock.patch('gists.views.threading.Thread')
+    def test_single_refresh(self, Thread, update):
+        # Both requests get the stale statistics, and the second one doesn't
+        # start a refresh while the first one's is running
+        for _ in range(2):
+            response = self.client.get('/api/stats/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, self.stale)
+        self.assertEqual(Thread.call_count, 1)
+        update.assert_not_called()
+
+        with mock.patch('gists.views.connection'):
+            Thread.call_args[1]['target']()
+        update.assert_called_once_with()
+        # The lock is released with the refresh
+        self.client.get('/api/stats/')
+        self.assertEqual(Thread.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProfileMothertongueTestCase(APITestCase):
+
+    def setUp(self):
+        self.alice = create_profile('alice')
+        self.bob = create_profile('bob')
+        self.carol = create_profile('carol', mothertongue='other')
+
+        self.by_alice_bob = Tree.objects.create()
+        root = create_sentence(self.by_alice_bob, self.alice)
+        create_sentence(self.by_alice_bob, self.bob, parent=root)
+        self.by_bob_carol = Tree.objects.create()
+        root = create_sentence(self.by_bob_carol, self.bob)
+        create_sentence(self.by_bob_carol, self.carol, parent=root)
+        self.by_alice = Tree.objects.create()
+        create_sentence(self.by_alice, self.alice)
+
+    def set_mothertongue(self, profile, mothertongue):
+        self.client.login(username=profile.user.username, password='pass')
+        url = '/api/profiles/{}/'.format(profile.pk)
+        data = self.client.get(url).data
+        data['mothertongue'] = mothertongue
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def assertTouched(self, trees):
+        self.assertEqual(
+            set(Tree.objects.filter(touched_by_other_mothertongue=True)),
+            set(trees))
+
+    def test_update(self):
+        self.assertTouched([self.by_bob_carol])
+        self.set_mothertongue(self.bob, 'other')
+        self.assertTouched([self.by_alice_bob, self.by_bob_carol])
+        self.set_mothertongue(self.bob, 'english')
+        self.assertTouched([self.by_bob_carol])
+        self.set_mothertongue(self.carol, 'english')
+        self.assertTouched([])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HeartbeatsTestCase(APITestCase):
+
+    def setUp(self):
+        self.alice = create_profile('alice')
+        self.bob = create_profile('bob')
+        self.trees = [Tree.objects.create(sentences_count=1)
+                      for _ in range(3)]
+        self.timeout = timedelta(seconds=20)
+        old = now() - 2 * self.timeout
+        Tree.objects.filter(pk=self.trees[0].pk)\
+            .update(profile_lock=self.alice, profile_lock_heartbeat=now())
+        Tree.objects.filter(pk=self.trees[1].pk)\
+            .update(profile_lock=self.bob, profile_lock_heartbeat=now())
+        # Expired lease
+        Tree.objects.filter(pk=self.trees[2].pk)\
+            .update(profile_lock=self.alice, profile_lock_heartbeat=old)
+        self.client.login(username='alice', password='pass')
+
+    def heartbeats(self, data):
+        return self.client.put('/api/trees/heartbeats/', data, format='json')
+
+    def test_heartbeats(self):
+        before = dict(Tree.objects
+                      .values_list('pk', 'profile_lock_heartbeat'))
+        response = self.heartbeats({'trees': [tree.pk
+                                              for tree in self.trees]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'held': [self.trees[0].pk],
+            'lost': [self.trees[1].pk, self.trees[2].pk]})
+
+        after = dict(Tree.objects.values_list('pk', 'profile_lock_heartbeat'))
+        self.assertGreater(after[self.trees[0].pk], before[self.trees[0].pk])
+        for tree in self.trees[1:]:
+            self.assertEqual(after[tree.pk], before[tree.pk])
+
+    def test_invalid(self):
+        pk = self.trees[0].pk
+        for data in ([pk], {'trees': pk}, {'trees': [True]},
+                     {'trees': [str(pk)]}, {}):
+            self.assertEqual(self.heartbeats(data).status_code, 400, data)
+
+
+class LevenshteinTestCase(TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        alphabet = list('abc ')
+        self.pairs = [(''.join(random.choice(alphabet, random.randint(20))),
+                       ''.join(random.choice(alphabet, random.randint(20))))
+                      for _ in range(500)]
+        # Several reformulations of each parent, and repeated pairs
+        self.pairs += [(s1, s2 + s1[::2]) for s1, s2 in self.pairs[:100]]
+        self.pairs += self.pairs[:50]
+        self.distances = [levenshtein(s1, s2) for s1, s2 in self.pairs]
+
+    def test_bitparallel(self):
+        self.assertEqual([bitparallel_levenshtein(s1, s2)
+                          for s1, s2 in self.pairs], self.distances)
+
+    @mock.patch('gists.utils.c_levenshtein', None)
+    def test_batch(self):
+        self.assertEqual(levenshtein_batch(self.pairs), self.distances)
+
+
+class ColumnarTestCase(TestCase):
+
+    def test_string_nulls(self):
+        strings = ['tree', None, '', 'ünïcode']
+        table = {'strings': StringColumn.from_strings(strings),
+                 'empty': StringColumn.from_strings(['', 'no nulls'])}
+        for compress in (False, True):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = tmpdir + '/table'
+                save_table(path, table, compress=compress)
+                loaded = load_table(path + '.npz' if compress else path)
+                self.assertEqual(list(loaded['strings']), strings)
+                self.assertEqual(list(loaded['empty']), ['', 'no nulls'])
+                self.assertIsNone(loaded['empty'].nulls)
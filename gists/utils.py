@@ -1,6 +1,11 @@
 import re
 
 import nltk
+try:
+    # Optional C implementation, much faster than anything in pure Python
+    from Levenshtein import distance as c_levenshtein
+except ImportError:
+    c_levenshtein = None
 
 
 class ContractionlessTokenizer(nltk.tokenize.treebank.TreebankWordTokenizer):
@@ -21,16 +26,6 @@ class ContractionlessTokenizer(nltk.tokenize.treebank.TreebankWordTokenizer):
     CONTRACTIONS4 = []
 
 
-def memoize(func):
-    cache = {}
-
-    def inner(*args):
-        if args not in cache:
-            cache[args] = func(*args)
-        return cache[args]
-    return inner
-
-
 def levenshtein(s1, s2):
     """Compute levenshtein distance between `s1` and `s2`."""
     if len(s1) < len(s2):
@@ -51,3 +46,85 @@ def levenshtein(s1, s2):
         previous_row = current_row
 
     return previous_row[-1]
+
+
+def pattern_bits(pattern):
+    """Bit masks of the positions of each character in `pattern`, for
+    `bitparallel_distance()`."""
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def bitparallel_distance(peq, length, text):
+    """Compute levenshtein distance between `text` and the pattern of
+    `length` characters whose `pattern_bits()` are `peq`, with Myers'
+    bit-vector algorithm (in Hyyrö's formulation).
+
+    Each column of the dynamic programming matrix is encoded in the bits of
+    Python integers, so the cost is one handful of big-integer operations per
+    character of `text` instead of one Python loop iteration per cell.
+
+    """
+    if length == 0:
+        return len(text)
+
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv = mask
+    mv = 0
+    score = length
+
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+
+    return score
+
+
+def bitparallel_levenshtein(s1, s2):
+    """Compute levenshtein distance between `s1` and `s2` with
+    `bitparallel_distance()`, using the shorter string as the pattern."""
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    return bitparallel_distance(pattern_bits(s2), len(s2), s1)
+
+
+# Fastest available levenshtein implementation
+fast_levenshtein = c_levenshtein or bitparallel_levenshtein
+
+
+def levenshtein_batch(pairs):
+    """Compute levenshtein distances for a list of `(s1, s2)` pairs.
+
+    Identical pairs are only computed once. The C implementation from the
+    `Levenshtein` package is used if it is installed; otherwise the bit masks
+    of each distinct `s1` are built once and shared by all its pairs, e.g. by
+    all the reformulations of a parent sentence.
+
+    """
+    distances = {}
+    patterns = {}
+    for pair in pairs:
+        if pair in distances:
+            continue
+        s1, s2 = pair
+        if c_levenshtein is not None:
+            distances[pair] = c_levenshtein(s1, s2)
+            continue
+        if s1 not in patterns:
+            patterns[s1] = pattern_bits(s1)
+        distances[pair] = bitparallel_distance(patterns[s1], len(s1), s2)
+    return [distances[pair] for pair in pairs]
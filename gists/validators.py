@@ -1,7 +1,8 @@
 import re
+import threading
+from functools import lru_cache
 
 import nltk
-import hunspell
 from django.core.exceptions import ValidationError
 from django.utils.deconstruct import deconstructible
 from django.conf import settings
@@ -9,6 +10,37 @@ from django.conf import settings
 from .utils import ContractionlessTokenizer
 
 
+# Number of tokens for which we remember the spell-checking verdict
+SPELLING_CACHE_SIZE = 100000
+
+_hunspellers = {}
+_hunspellers_lock = threading.Lock()
+
+
+def get_hunspellers(language):
+    """Get the Hunspell spellers for `language`.
+
+    Dictionaries are large and slow to load, so they are loaded on first use
+    and then shared by the whole process.
+
+    """
+    if language not in _hunspellers:
+        with _hunspellers_lock:
+            if language not in _hunspellers:
+                import hunspell
+                _hunspellers[language] = [
+                    hunspell.HunSpell(dicts['DIC'], dicts['AFF'])
+                    for dicts in settings.HUNSPELL[language]]
+    return _hunspellers[language]
+
+
+@lru_cache(maxsize=SPELLING_CACHE_SIZE)
+def is_spelled_correctly(language, token):
+    """Check `token` against the dictionaries of `language`, stopping at the
+    first one which knows it."""
+    return any(speller.spell(token) for speller in get_hunspellers(language))
+
+
 class SpellingError(ValidationError):
     pass
 
@@ -19,14 +51,22 @@ class SpellingValidator:
     CHARACTER_START = re.compile(r'^\w')
 
     def __init__(self, language):
+        # Validators are instantiated when models (and migrations) are
+        # imported, i.e. by every management command and at worker boot, so
+        # nothing heavy must happen here: dictionaries are loaded on the first
+        # validation.
         self.language = language
-        self.hunspellers = [hunspell.HunSpell(dicts['DIC'], dicts['AFF'])
-                            for dicts in settings.HUNSPELL[language]]
-        self.tokenizer = ContractionlessTokenizer()
+        self._tokenizer = None
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = ContractionlessTokenizer()
+        return self._tokenizer
 
     def __call__(self, text):
-        from .models import GistsConfiguration
-        if GistsConfiguration.get_solo().jabberwocky_mode:
+        from .config import get_config
+        if get_config().jabberwocky_mode:
             # Spell-checking deactivated for Jabberwockies
             return
 
@@ -35,8 +75,7 @@ class SpellingValidator:
                   for token in self.tokenizer.tokenize(sentence)
                   if self.CHARACTER_START.search(token) is not None]
         mispelled = [token for token in tokens
-                     if not sum([speller.spell(token)
-                                 for speller in self.hunspellers])]
+                     if not is_spelled_correctly(self.language, token)]
 
         if len(mispelled) > 0:
             raise SpellingError("SpellingError: {}"
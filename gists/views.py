@@ -1,29 +1,45 @@
-from datetime import timedelta
+import json
+import time
+import hashlib
+import threading
+from datetime import timedelta, datetime
+from itertools import groupby
+from operator import itemgetter
 try:
     from django.utils.timezone import now
 except ImportError:
-    from datetime import datetime
     now = datetime.now
 
 from django.contrib.auth.models import User
-from django.db.models import Count, Max, F, Q
-from django.db import transaction
+from django.db import transaction, connection
 from django.core.exceptions import PermissionDenied
 from django.conf import settings
-from django.shortcuts import get_object_or_404, redirect
+from django.core.cache import cache, caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.utils.decorators import method_decorator
+from django.utils.timezone import utc
+from django.views.decorators.http import condition
 from django.contrib.sites.shortcuts import get_current_site
 from rest_framework import viewsets, mixins, filters, views
 from rest_framework.decorators import list_route, detail_route
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.permissions import IsAuthenticated
 from allauth.account.models import EmailAddress
 from rest_condition import C
-from numpy.random import choice
 
+from gists.config import get_config
 from gists.filters import TreeFilter
-from gists.models import (Sentence, Tree, Profile, Questionnaire,
-                          WordSpan, Comment, GistsConfiguration,
+from gists.locking import (claim_random_tree, heartbeat_tree,
+                           heartbeat_trees, release_tree)
+from gists.sampling import random_instance
+from gists.models import (Sentence, Tree, Profile, ProfileStats,
+                          ProfileBucketCounts, Questionnaire, WordSpan,
+                          Comment,
                           LANGUAGE_CHOICES, OTHER_LANGUAGE, DEFAULT_LANGUAGE,
                           GENDER_CHOICES, EDUCATION_LEVEL_CHOICES,
                           JOB_TYPE_CHOICES,)
@@ -79,13 +95,28 @@ class APIRoot(views.APIView):
         })
 
 
+def meta_etag(request, *args, **kwargs):
+    return Meta.rendered()[2]
+
+
+def meta_last_modified(request, *args, **kwargs):
+    version = Meta.rendered()[0].version
+    if version is not None:
+        return datetime.fromtimestamp(version, utc)
+
+
 class Meta(views.APIView):
     """
     Meta information about the server.
     """
-    def get(self, request, format=None):
-        config = GistsConfiguration.get_solo()
-        return Response({
+
+    # Configuration snapshot, json body and ETag of the last rendered
+    # response, which only changes with the configuration (and the code)
+    _rendered = None
+
+    @classmethod
+    def get_data(cls, config):
+        return {
             # Tree shaping
             'target_branch_depth': config.target_branch_depth,
             'target_branch_count': config.target_branch_count,
@@ -118,16 +149,47 @@ class Meta(views.APIView):
 
             # Server version
             'version': settings.VERSION,
-        })
+        }
+
+    @classmethod
+    def rendered(cls):
+        """Get the configuration snapshot, json body and ETag of the
+        response, rendering them again only if the configuration changed."""
+        config = get_config()
+        rendered = cls._rendered
+        if rendered is None or rendered[0] != config:
+            body = JSONRenderer().render(cls.get_data(config))
+            # Unquoted, as condition() quotes it
+            etag = hashlib.md5(body).hexdigest()
+            rendered = cls._rendered = (config, body, etag)
+        return rendered
+
+    @method_decorator(condition(etag_func=meta_etag,
+                                last_modified_func=meta_last_modified))
+    def get(self, request, format=None):
+        config, body, _ = self.rendered()
+        if request.accepted_renderer.format != 'json':
+            # Browsable API
+            return Response(self.get_data(config))
+        return HttpResponse(body, content_type='application/json')
 
 
 class Stats(views.APIView):
     """
     Public descriptive statistics about the data, with a cooled-down update.
+
+    Stale statistics are served immediately while a single background thread
+    (across all workers sharing the cache) refreshes them. The refresh lock
+    lives in `settings.STATS_LOCK_CACHE`, and is only reliable with a cache
+    whose add() is atomic: with the file-based cache, two workers may
+    occasionally refresh at the same time, which is harmless.
     """
 
     COOLDOWN_PERIOD = timedelta(minutes=3)
-    stats = None
+    CACHE_KEY = 'gists:stats'
+    LOCK_KEY = 'gists:stats:lock'
+    # Safety expiry of the refresh lock, in case a refresh dies
+    LOCK_TIMEOUT = 5 * 60
     permission_classes = (
         # Anybody can read
         C(WantsSafe) |
@@ -135,34 +197,80 @@ class Stats(views.APIView):
         (C(WantsPost) & C(IsAdmin)),
     )
 
-    def __init__(self, *args, **kwargs):
-        super(Stats, self).__init__(*args, **kwargs)
-        if (self.stats is None or
-                now() - self.COOLDOWN_PERIOD > self.stats['updated']):
-            self.update()
-
     @classmethod
     def update(cls):
-        cls.stats = {
-            'updated': now(),
-            'mean_errs_per_profile': Sentence.mean_errs_per_profile(),
-            'mean_read_time_proportion_per_profile':
-                Sentence.mean_read_time_proportion_per_profile(),
-            'mean_write_time_proportion_per_profile':
-                Sentence.mean_write_time_proportion_per_profile(),
-            'profiles_word_spans': Profile.word_spans()
-        }
+        """Build the statistics from the running per-profile aggregates, and
+        share them with all workers through the cache."""
+        start = time.time()
+        stats = ProfileStats.means_per_profile()
+        stats['profiles_word_spans'] = ProfileStats.word_spans()
+        stats['updated'] = now()
+        stats['update_duration'] = time.time() - start
+        cache.set(cls.CACHE_KEY, stats, None)
+        return stats
+
+    @classmethod
+    def acquire_lock(cls):
+        # add() only succeeds if the key doesn't exist yet
+        return caches[settings.STATS_LOCK_CACHE].add(cls.LOCK_KEY, True,
+                                                     cls.LOCK_TIMEOUT)
+
+    @classmethod
+    def release_lock(cls):
+        caches[settings.STATS_LOCK_CACHE].delete(cls.LOCK_KEY)
+
+    @classmethod
+    def locked_update(cls):
+        """Update the statistics unless another update is already running.
+
+        Returns the new statistics, or None if another update was running.
+
+        """
+        if not cls.acquire_lock():
+            return None
+        try:
+            return cls.update()
+        finally:
+            cls.release_lock()
+
+    @classmethod
+    def background_update(cls):
+        """Update the statistics in a background thread, unless another
+        update is already running."""
+        if not cls.acquire_lock():
+            return
+
+        def run():
+            try:
+                cls.update()
+            finally:
+                cls.release_lock()
+                # Threads get their own database connection, which Django
+                # doesn't close for us outside of the request cycle
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def get_stats(cls):
+        stats = cache.get(cls.CACHE_KEY)
+        if stats is None:
+            # Nothing to serve yet, so we have to wait for the update
+            return cls.locked_update() or cls.update()
+        if now() - cls.COOLDOWN_PERIOD > stats['updated']:
+            cls.background_update()
+        return stats
 
     def get(self, request, format=None):
         """Descriptive statistics about the data, with cooled-down update."""
-        if now() - self.COOLDOWN_PERIOD > self.stats['updated']:
-            self.update()
-        return Response(self.stats)
+        return Response(self.get_stats())
 
     def post(self, request, format=None):
-        """Force update of the statistics, admin-only."""
-        self.update()
-        return Response(self.stats)
+        """Force update of the statistics, admin-only. If an update is
+        already running, serve the current statistics."""
+        return Response(self.locked_update() or self.get_stats())
 
 
 class TreeViewSet(viewsets.ReadOnlyModelViewSet):
@@ -176,53 +284,80 @@ class TreeViewSet(viewsets.ReadOnlyModelViewSet):
 
     PRIORITY_SHAPING = 'priority_shaping'
 
+    def get_queryset(self):
+        # Fetch everything TreeSerializer reads in a constant number of
+        # queries, whatever the number of trees serialized
+        return self.queryset\
+            .select_related('root__profile__user')\
+            .prefetch_related('sentences', 'root__children')
+
     @detail_route(methods=['put'],
                   permission_classes=[C(IsAuthenticated) & C(HasProfile)])
-    @transaction.atomic()
     def heartbeat(self, request, pk=None, format=None):
         profile = self.request.user.profile
-        timeout = GistsConfiguration.get_solo().heartbeat_timeout
+        timeout = get_config().heartbeat_timeout
+
+        # A single conditional update, which only touches the tree if the
+        # profile still holds a valid lock on it
+        if not heartbeat_tree(pk, profile, timeout):
+            # Submitting a sentence releases the tree, and a heartbeat sent
+            # before the submission's answer may arrive after it
+            if Sentence.objects.filter(tree_id=pk, profile=profile,
+                                       created__gte=now() - timeout)\
+                    .exists():
+                return Response({'status': 'tree lock released',
+                                 'locked': False})
+            if not self.queryset.filter(pk=pk).exists():
+                raise Http404
+            raise PermissionDenied('tree is not locked by requesting profile')
 
-        # self.get_object() doesn't let us use select_for_update(), which we
-        # need to lock this tree for the duration of the view. So we directly
-        # use django's get_object_or_404 with self.check_object_permissions().
-        tree = get_object_or_404(self.get_queryset().select_for_update(),
-                                 pk=pk)
-        self.check_object_permissions(self.request, tree)
+        return Response({'status': 'tree lock heartbeaten', 'locked': True})
 
-        if (tree.profile_lock is None or tree.profile_lock.id != profile.id
-                or tree.profile_lock_heartbeat < now() - timeout):
-            raise PermissionDenied('tree is not locked by requesting profile')
+    # Maximum number of trees heartbeaten in one request
+    MAX_HEARTBEATS = 100
+
+    @list_route(methods=['put'],
+                permission_classes=[C(IsAuthenticated) & C(HasProfile)])
+    def heartbeats(self, request, format=None):
+        """Heartbeat the profile's locks on all the trees listed in
+        `trees`, at once.
 
-        tree.profile_lock_heartbeat = now()
-        tree.save()
-        return Response({'status': 'tree lock heartbeaten'})
+        Returns the trees whose lock the profile still holds (and which were
+        heartbeaten) and those whose lock it lost.
 
-    def filter_branches_count_lte(self, queryset, value):
-        qs = queryset.annotate(branches_count=Count('root__children'))
-        return qs.filter(branches_count__lte=value)
+        """
+        if not isinstance(request.data, dict):
+            raise ParseError("expected an object with a 'trees' list")
+        pks = request.data.get('trees')
+        # Booleans are ints too
+        if (not isinstance(pks, list)
+                or not all(type(pk) is int for pk in pks)):
+            raise ParseError("'trees' must be a list of tree ids")
+        if len(pks) > self.MAX_HEARTBEATS:
+            raise ParseError("can't heartbeat more than {} trees at once"
+                             .format(self.MAX_HEARTBEATS))
 
-    def filter_shortest_branch_depth_lte(self, queryset, value):
-        pks = [tree.pk for tree in queryset
-               if tree.shortest_branch_depth <= value]
-        return queryset.filter(pk__in=pks)
+        profile = self.request.user.profile
+        timeout = get_config().heartbeat_timeout
+        held = heartbeat_trees(pks, profile, timeout)
+        return Response({
+            'held': sorted(held),
+            'lost': sorted(set(pks) - held),
+        })
 
     def filter_shape(self, queryset):
-        config = GistsConfiguration.get_solo()
-        # Can't be full
-        queryset = queryset\
-            .annotate(sentences_count=Count('sentences'))\
-            .filter(sentences_count__lte=config.target_branch_count
-                    * config.target_branch_depth + 1)
-        # Can't exceed width
-        queryset = self.filter_branches_count_lte(
-            queryset, config.target_branch_count)
-        # Can't exceed max depth on all branches (but can reach it on all
-        # branches: if the target width isn't reached but all existing branches
-        # are at maximum length, you can still start a new branch)
-        queryset = self.filter_shortest_branch_depth_lte(
-            queryset, config.target_branch_depth)
-        return queryset
+        config = get_config()
+        return queryset.filter(
+            # Can't be full
+            sentences_count__lte=config.target_branch_count
+            * config.target_branch_depth + 1,
+            # Can't exceed width
+            branches_count__lte=config.target_branch_count,
+            # Can't exceed max depth on all branches (but can reach it on all
+            # branches: if the target width isn't reached but all existing
+            # branches are at maximum length, you can still start a new
+            # branch)
+            shortest_branch_depth__lte=config.target_branch_depth)
 
     def has_boolean_param(self, params, name):
         return name in params and params.get(name).lower() == 'true'
@@ -234,60 +369,99 @@ class TreeViewSet(viewsets.ReadOnlyModelViewSet):
 
         # Look for shaped trees first, if asked to
         if self.has_boolean_param(request.query_params, self.PRIORITY_SHAPING):
-            shaped_pks = self.filter_shape(queryset)\
-                .values_list('pk', flat=True)
-            if len(shaped_pks) > 0:
-                tree = Tree.objects.get(pk=choice(shaped_pks))
+            tree = random_instance(self.filter_shape(queryset))
 
         # Shaping wasn't requested, or no shaped trees were available
         if tree is None:
-            pks = queryset.values_list('pk', flat=True)
-            if len(pks) > 0:
-                tree = Tree.objects.get(pk=choice(pks))
+            tree = random_instance(queryset)
 
         serializer = self.get_serializer([tree] if tree is not None else [],
                                          many=True)
         return Response(serializer.data)
 
     @list_route(permission_classes=[C(IsAuthenticated) & C(HasProfile)])
-    @transaction.atomic()
     def lock_random_tree(self, request, format=None):
         profile = self.request.user.profile
-        timeout = GistsConfiguration.get_solo().heartbeat_timeout
+        timeout = get_config().heartbeat_timeout
         tree = None
-
-        free_qs = self.filter_queryset(self.get_queryset())\
-            .select_for_update()\
-            .filter(root__isnull=False)\
-            .annotate(last_sentence=Max('sentences__created'))\
-            .filter(Q(profile_lock_heartbeat__lt=now() - timeout)
-                    | Q(last_sentence__gt=F('profile_lock_heartbeat')))
+        queryset = self.filter_queryset(self.get_queryset())
 
         # Look for free shaped trees first, if asked to
         if self.has_boolean_param(request.query_params, self.PRIORITY_SHAPING):
-            shaped_free_pks = self.filter_shape(free_qs)\
-                .values_list('pk', flat=True)
-            if len(shaped_free_pks) > 0:
-                tree = Tree.objects.get(pk=choice(shaped_free_pks))
+            tree = claim_random_tree(self.filter_shape(queryset), profile,
+                                     timeout)
 
         # Shaping wasn't requested, or no free shaped trees were available
         if tree is None:
-            free_pks = free_qs.values_list('pk', flat=True)
-            if len(free_pks) > 0:
-                tree = Tree.objects.get(pk=choice(free_pks))
-
-        # If we found something, lock it
-        if tree is not None:
-            tree.profile_lock = profile
-            tree.profile_lock_heartbeat = now()
-            tree.save()
-            trees = [tree]
-        else:
-            trees = []
+            tree = claim_random_tree(queryset, profile, timeout)
 
+        trees = [tree] if tree is not None else []
         serializer = self.get_serializer(trees, many=True)
         return Response(serializer.data)
 
+    EXPORT_TREE_FIELDS = ('created', 'sentences_count', 'branches_count',
+                          'shortest_branch_depth')
+    EXPORT_SENTENCE_FIELDS = ('id', 'created', 'profile', 'parent', 'text',
+                              'language', 'bucket', 'depth',
+                              'read_time_proportion', 'read_time_allotted',
+                              'write_time_proportion', 'write_time_allotted')
+
+    # Number of trees whose sentences are fetched at once when exporting
+    EXPORT_CHUNK_SIZE = 100
+
+    @list_route(permission_classes=[C(IsAuthenticated) & C(IsAdmin)])
+    def export(self, request, format=None):
+        """Stream all trees with their sentences and edges, one json object
+        per line, admin-only.
+
+        Sentences are fetched ordered by tree, for chunks of trees taken by
+        pk ranges, so the export is done in one pass and only one chunk is in
+        memory at a time (whatever the database driver does with cursors).
+        Trees without sentences are not exported.
+
+        """
+        tree_fields = ['tree__' + field for field in self.EXPORT_TREE_FIELDS]
+        fields = ['tree'] + tree_fields + list(self.EXPORT_SENTENCE_FIELDS)
+
+        def rows():
+            last_pk = 0
+            while True:
+                pks = list(Tree.objects
+                           .filter(pk__gt=last_pk)
+                           .order_by('pk')
+                           .values_list('pk', flat=True)
+                           [:self.EXPORT_CHUNK_SIZE])
+                if len(pks) == 0:
+                    return
+                chunk = Sentence.objects\
+                    .filter(tree__gte=pks[0], tree__lte=pks[-1])\
+                    .order_by('tree', 'pk')\
+                    .values(*fields)
+                for row in chunk:
+                    yield row
+                last_pk = pks[-1]
+
+        def lines():
+            for tree_pk, sentences in groupby(rows(),
+                                              itemgetter('tree')):
+                sentences = list(sentences)
+                tree = {'id': tree_pk}
+                for field, tree_field in zip(self.EXPORT_TREE_FIELDS,
+                                             tree_fields):
+                    tree[field] = sentences[0][tree_field]
+                tree['sentences'] = [
+                    dict((field, sentence[field])
+                         for field in self.EXPORT_SENTENCE_FIELDS)
+                    for sentence in sentences]
+                tree['network_edges'] = [
+                    {'source': sentence['parent'], 'target': sentence['id']}
+                    for sentence in sentences
+                    if sentence['parent'] is not None]
+                yield json.dumps(tree, cls=DjangoJSONEncoder) + '\n'
+
+        return StreamingHttpResponse(lines(),
+                                     content_type='application/x-ndjson')
+
 
 class SentenceViewSet(mixins.CreateModelMixin,
                       mixins.RetrieveModelMixin,
@@ -296,7 +470,9 @@ class SentenceViewSet(mixins.CreateModelMixin,
     """
     Sentence list and detail, unauthenticated read, authenticated creation.
     """
-    queryset = Sentence.objects.all()
+    queryset = Sentence.objects\
+        .select_related('profile__user')\
+        .prefetch_related('children')
     serializer_class = SentenceSerializer
     permission_classes = (
         # Anybody can read
@@ -306,11 +482,26 @@ class SentenceViewSet(mixins.CreateModelMixin,
     )
     ordering = ('-created',)
 
+    # How many empty trees to try claiming before creating a new one
+    EMPTY_TREE_ATTEMPTS = 5
+
     @classmethod
     def obtain_empty_tree(cls):
-        trees = Tree.objects.annotate(sentences_count=Count('sentences'))
-        return trees.filter(sentences_count=0).first() or Tree.objects.create()
+        """Claim an empty tree for a new root sentence, or create one.
+
+        Claiming is a conditional update on the tree's `has_root` flag, so
+        concurrent root submissions never get the same tree.
 
+        """
+        pks = Tree.objects.filter(has_root=False)\
+            .values_list('pk', flat=True)[:cls.EMPTY_TREE_ATTEMPTS]
+        for pk in pks:
+            if Tree.objects.filter(pk=pk, has_root=False)\
+                    .update(has_root=True) == 1:
+                return Tree.objects.get(pk=pk)
+        return Tree.objects.create(has_root=True)
+
+    @transaction.atomic()
     def perform_create(self, serializer):
         profile = self.request.user.profile
 
@@ -326,7 +517,18 @@ class SentenceViewSet(mixins.CreateModelMixin,
             tree = parent.tree
             tree_as_root = None
 
-        serializer.save(profile=profile, tree=tree, tree_as_root=tree_as_root)
+        parent_errs = Sentence.parent_errs_for(
+            parent, serializer.validated_data['text'])
+        sentence = serializer.save(profile=profile, tree=tree,
+                                   tree_as_root=tree_as_root,
+                                   parent_errs=parent_errs,
+                                   **Sentence.shape_from_parent(parent))
+        tree.add_to_shape(sentence)
+        tree.add_to_participation(sentence)
+        ProfileStats.add_sentence(sentence)
+        ProfileBucketCounts.add_sentence(sentence)
+        # Adding a sentence ends the work on the tree, so free it up
+        release_tree(tree)
 
 
 class ProfileViewSet(mixins.CreateModelMixin,
@@ -338,7 +540,7 @@ class ProfileViewSet(mixins.CreateModelMixin,
     Profile list and detail, unauthenticated read, authenticated creation
     and modification.
     """
-    queryset = Profile.objects.all()
+    queryset = Profile.objects.prefetch_related('bucket_counts')
     serializer_class = ProfileSerializer
     permission_classes = (
         # Anybody can read
@@ -361,6 +563,15 @@ class ProfileViewSet(mixins.CreateModelMixin,
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @transaction.atomic()
+    def perform_update(self, serializer):
+        mothertongue = serializer.instance.mothertongue
+        profile = serializer.save()
+        # Trees materialize whether a profile with another mothertongue
+        # participated in them
+        if profile.mothertongue != mothertongue:
+            Tree.update_mothertongue_participation(profile)
+
 
 class QuestionnaireViewSet(mixins.CreateModelMixin,
                            mixins.RetrieveModelMixin,
@@ -423,7 +634,8 @@ class WordSpanViewSet(mixins.CreateModelMixin,
         return self.queryset.none()
 
     def perform_create(self, serializer):
-        serializer.save(profile=self.request.user.profile)
+        word_span = serializer.save(profile=self.request.user.profile)
+        ProfileStats.add_word_span(word_span)
 
 
 class CommentViewSet(mixins.CreateModelMixin,
@@ -465,7 +677,7 @@ class UserViewSet(mixins.RetrieveModelMixin,
     User list and detail, unauthenticated read, and authenticated modification
     (everything if staff, only username if self).
     """
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related('profile__bucket_counts')
     permission_classes = (
         # Anybody can read
         C(WantsRetrieve) | C(WantsList) |
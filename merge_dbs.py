@@ -1,7 +1,7 @@
+import os
 import sys
 import json
 import argparse
-import copy
 
 
 class Merger:
@@ -25,62 +25,109 @@ class Merger:
           "introduced_exp_home", "introduced_exp_play", "introduced_play_home",
           "introduced_play_play", "prolific_id"]),
         ("gists.tree",
-         ["created", "profile_lock", "profile_lock_heartbeat"]),
+         ["created", "profile_lock", "profile_lock_heartbeat",
+          "sentences_count", "branches_count", "shortest_branch_depth",
+          "root_language", "root_bucket", "touched_by_other_mothertongue",
+          "has_root"]),
         ("gists.sentence",
          ["created", "tree", "profile", "parent", "tree_as_root", "text",
           "read_time_proportion", "read_time_allotted",
           "write_time_proportion", "write_time_allotted", "language",
-          "bucket"]),
+          "bucket", "depth", "head", "branch_depth", "parent_errs"]),
         ("gists.comment",
          ["created", "profile", "email", "meta", "text"]),
         ("gists.questionnaire",
          ["created", "profile", "age", "gender", "informed", "informed_how",
           "informed_what", "education_level", "education_freetext", "job_type",
           "job_freetext"]),
+        ("gists.profilestats",
+         ["profile", "reformulations_count", "errs_sum",
+          "read_time_proportion_sum", "write_time_proportion_sum",
+          "word_span"]),
+        ("gists.profilebucketcounts",
+         ["profile", "bucket", "sentences_count", "reformulations_count",
+          "trees_count"]),
     ]
 
-    def __init__(self, dbs):
-        self.dbs = dbs
-        self.pks = dict((model, []) for model, _ in self.MODELS)
-        self.merged_db = []
+    def __init__(self, dbs, state=None):
+        # Index the instances of each db by model, in a single pass over
+        # each db. Instances are updated in place while merging, so the dbs
+        # are consumed by the merge.
+        self.dbs = []
+        for db in dbs:
+            models = {}
+            for inst in db:
+                models.setdefault(inst['model'], []).append(inst)
+            self.dbs.append(models)
+        self._init_state(state)
+
+    def _init_state(self, state):
+        """Initialize the merge state, possibly from that of a previous merge
+        (as returned by `get_state()`) which we then append to."""
+        state = state or {}
+        # pk remapping tables: for each model, a list with one dict per
+        # merged db mapping its original pks to merged pks
+        self.pks = dict((model, [dict((int(pk), merged_pk)
+                                      for pk, merged_pk in db_pks.items())
+                                 for db_pks in state.get('pks', {})
+                                 .get(model, [])])
+                        for model, _ in self.MODELS)
+        self.singletons = state.get('singletons', {})
+        self.usernames_lower = set(state.get('usernames_lower', []))
+        self.emails_lower = set(state.get('emails_lower', []))
+
+    def get_state(self):
+        """Get the state of the merge, to append new dbs to it later."""
+        return {
+            'pks': self.pks,
+            'singletons': self.singletons,
+            'usernames_lower': sorted(self.usernames_lower),
+            'emails_lower': sorted(self.emails_lower),
+        }
 
     def _check_dbs(self):
-        model_fields = dict(self.MODELS)
+        model_fields = dict((model, set(fields))
+                            for model, fields in self.MODELS)
         known_models = set(model_fields.keys())
 
         # Check the models in the dbs are exactly what we know how to process
         for db in self.dbs:
-            assert set([inst["model"] for inst in db]) == known_models
+            assert set(db.keys()) == known_models
             # Check the fields are exactly the ones we know. A better solution
             # would be to check the version of spreadr with which the dbs were
             # created, or the migrations applied, but we have no access to that
             # (migrations aren't exposed by `python manage.py dumpdata ...`).
-            for inst in db:
-                assert set(inst["fields"].keys()) == \
-                    set(model_fields[inst["model"]])
+            for model, instances in db.items():
+                for inst in instances:
+                    assert set(inst["fields"].keys()) == model_fields[model]
 
     def merge_dbs(self):
+        """Iterate over the instances of the merged database."""
         self._check_dbs()
 
         for model, _ in self.MODELS:
-            getattr(self, model.replace('.', '_'))()
+            yield from getattr(self, model.replace('.', '_'))()
 
-    def _iter_models(self, name):
-        def db_instances(db):
-            return sorted([inst for inst in db if inst['model'] == name],
-                          key=lambda i: i['pk'])
+    def _db_instances(self, db, name):
+        """Instances of model `name` in `db`, ordered by pk."""
+        # Release each db's instances once they've been merged
+        db_instances = db.pop(name)
+        db_instances.sort(key=lambda i: i['pk'])
+        return db_instances
 
+    def _iter_models(self, name):
         for db in self.dbs:
-            yield db_instances(db)
-
-    def _flatten_values(cls, list_dicts):
-        return [value for subdict in list_dicts for value in subdict.values()]
+            yield self._db_instances(db, name)
 
     def _merge_singleton(self, name):
-        solo = None
+        # If we're appending to a previous merge, the singleton was already
+        # saved there
+        solo = self.singletons.get(name)
+        saved = solo is not None
 
         for db_instances in self._iter_models(name):
             # Check there's only one instance per db
+            db_instances = list(db_instances)
             assert len(db_instances) == 1
             db_instance = db_instances[0]
 
@@ -91,45 +138,51 @@ class Merger:
                 assert solo == db_instance
 
         # Save the one instance
-        self.merged_db.append(solo)
+        if not saved:
+            self.singletons[name] = solo
+            yield solo
 
     def _merge_model(self, name, foreign_keys={}, preprocess=None):
-        assert len(self.pks[name]) == 0
+        # Pks used by previous merges, if we're appending
+        used_pks = set(merged_pk for db_pks in self.pks[name]
+                       for merged_pk in db_pks.values())
+        max_pk = max(used_pks) if len(used_pks) > 0 else 0
+        offset = len(self.pks[name])
 
-        for i, db_instances in enumerate(self._iter_models(name)):
+        for i, db_instances in enumerate(self._iter_models(name), offset):
             db_pks = {}
             self.pks[name].append(db_pks)
 
             for inst in db_instances:
-                inst_copy = copy.deepcopy(inst)
+                original_pk = inst['pk']
 
                 # Preprocess and skip instance if asked to
                 if preprocess is not None:
-                    inst_copy = preprocess(inst_copy)
-                    if inst_copy is None:
+                    inst = preprocess(inst)
+                    if inst is None:
                         continue
 
                 # Update all non-null foreign keys
                 for fkey, ftype in foreign_keys.items():
                     if inst['fields'][fkey] is not None:
-                        inst_copy['fields'][fkey] = \
+                        inst['fields'][fkey] = \
                             self.pks[ftype][i][inst['fields'][fkey]]
 
                 # Update pk
-                flat_pks = self._flatten_values(self.pks[name])
-                if inst_copy['pk'] in flat_pks:
-                    inst_copy['pk'] = max(flat_pks) + 1
-                db_pks[inst['pk']] = inst_copy['pk']
+                if inst['pk'] in used_pks:
+                    inst['pk'] = max_pk + 1
+                used_pks.add(inst['pk'])
+                max_pk = max(max_pk, inst['pk'])
+                db_pks[original_pk] = inst['pk']
 
                 # Save the instance
-                self.merged_db.append(inst_copy)
+                yield inst
 
     def auth_user(self):
-        usernames_lower = set()
+        usernames_lower = self.usernames_lower
 
         def dedup_username(user):
             username = user['fields']['username']
-            user_copy = copy.deepcopy(user)
 
             if username.lower() in usernames_lower:
                 # Find a new unique username
@@ -142,15 +195,15 @@ class Merger:
                 # Record the change
                 print("Duplicate user '{}', updating username to '{}'"
                       .format(original_username, username))
-                user_copy['fields']['username'] = username
+                user['fields']['username'] = username
 
             usernames_lower.add(username.lower())
-            return user_copy
+            return user
 
-        self._merge_model('auth.user', preprocess=dedup_username)
+        return self._merge_model('auth.user', preprocess=dedup_username)
 
     def account_emailaddress(self):
-        emails_lower = set()
+        emails_lower = self.emails_lower
 
         def skip_dup_email(emailaddress):
             email = emailaddress['fields']['email']
@@ -162,38 +215,47 @@ class Merger:
             emails_lower.add(email.lower())
             return emailaddress
 
-        self._merge_model('account.emailaddress',
-                          foreign_keys={'user': 'auth.user'},
-                          preprocess=skip_dup_email)
+        return self._merge_model('account.emailaddress',
+                                 foreign_keys={'user': 'auth.user'},
+                                 preprocess=skip_dup_email)
 
     def sites_site(self):
-        self._merge_singleton('sites.site')
+        return self._merge_singleton('sites.site')
 
     def gists_gistsconfiguration(self):
-        self._merge_singleton('gists.gistsconfiguration')
+        return self._merge_singleton('gists.gistsconfiguration')
 
     def gists_profile(self):
-        self._merge_model('gists.profile',
-                          foreign_keys={'user': 'auth.user'})
+        return self._merge_model('gists.profile',
+                                 foreign_keys={'user': 'auth.user'})
 
     def gists_tree(self):
-        self._merge_model('gists.tree',
-                          foreign_keys={'profile_lock': 'gists.profile'})
+        return self._merge_model(
+            'gists.tree', foreign_keys={'profile_lock': 'gists.profile'})
 
     def gists_sentence(self):
-        self._merge_model('gists.sentence',
-                          foreign_keys={'tree': 'gists.tree',
-                                        'tree_as_root': 'gists.tree',
-                                        'parent': 'gists.sentence',
-                                        'profile': 'gists.profile'})
+        return self._merge_model('gists.sentence',
+                                 foreign_keys={'tree': 'gists.tree',
+                                               'tree_as_root': 'gists.tree',
+                                               'parent': 'gists.sentence',
+                                               'head': 'gists.sentence',
+                                               'profile': 'gists.profile'})
 
     def gists_comment(self):
-        self._merge_model('gists.comment',
-                          foreign_keys={'profile': 'gists.profile'})
+        return self._merge_model('gists.comment',
+                                 foreign_keys={'profile': 'gists.profile'})
 
     def gists_questionnaire(self):
-        self._merge_model('gists.questionnaire',
-                          foreign_keys={'profile': 'gists.profile'})
+        return self._merge_model('gists.questionnaire',
+                                 foreign_keys={'profile': 'gists.profile'})
+
+    def gists_profilestats(self):
+        return self._merge_model('gists.profilestats',
+                                 foreign_keys={'profile': 'gists.profile'})
+
+    def gists_profilebucketcounts(self):
+        return self._merge_model('gists.profilebucketcounts',
+                                 foreign_keys={'profile': 'gists.profile'})
 
 
 if __name__ == '__main__':
@@ -204,18 +266,35 @@ if __name__ == '__main__':
                         default=sys.stdout,
                         help='output file for the merged json database; '
                         'defaults to stdout')
+    parser.add_argument('--state', metavar='STATE_FILE',
+                        help='json file holding the state of the merge '
+                        '(pk remapping tables, known usernames and emails); '
+                        'if it exists, the databases are appended to that '
+                        'previous merge and only the new instances are '
+                        'output; it is then updated with the new state')
     parser.add_argument('files', metavar='DB_FILE', nargs='+',
                         type=argparse.FileType('r'),
                         help='a json file of one of the databases to merge')
     args = parser.parse_args()
 
+    state = None
+    if args.state is not None and os.path.exists(args.state):
+        with open(args.state) as state_file:
+            state = json.load(state_file)
+
     dbs = []
     for file in args.files:
         dbs.append(json.load(file))
 
-    # Merge databases
-    merger = Merger(dbs)
-    merger.merge_dbs()
-
-    # Write the output
-    json.dump(merger.merged_db, args.outfile, indent=2)
+    # Merge databases, writing the output as we go
+    merger = Merger(dbs, state)
+    del dbs
+    args.outfile.write('[')
+    for i, inst in enumerate(merger.merge_dbs()):
+        args.outfile.write(',\n' if i > 0 else '\n')
+        args.outfile.write(json.dumps(inst))
+    args.outfile.write('\n]\n')
+
+    if args.state is not None:
+        with open(args.state, 'w') as state_file:
+            json.dump(merger.get_state(), state_file)
@@ -61,6 +61,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'gists.config.ConfigMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
@@ -134,12 +135,21 @@ DEFAULT_TRAINING_WORK = 5
 DEFAULT_BASE_CREDIT = 0
 
 
-# Caching
+# Caching, in files shared by all the workers on this host, so that they see
+# the same configuration version, stats snapshot and solo cache. Point it to
+# memcached or redis to share it across hosts (or to keep tree lock leases in
+# it, which needs an atomic add()).
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
     },
+    # Cache for tree lock leases (see LEASE_BACKEND below)
+    # 'leases': {
+    #     'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    #     'LOCATION': '127.0.0.1:11211',
+    # },
 }
 
 
@@ -150,6 +160,34 @@ SOLO_CACHE_TIMEOUT = 60 * 5  # 5 mins
 SOLO_CACHE_PREFIX = 'solo'
 
 
+# Per-request snapshots of the GistsConfiguration, reloaded when its version
+# in CONFIG_CACHE changes (which reaches all workers only if that cache is
+# shared), and at the latest after CONFIG_SNAPSHOT_TIMEOUT
+
+CONFIG_CACHE = 'default'
+CONFIG_SNAPSHOT_TIMEOUT = 60 * 5  # 5 mins
+
+
+# Tree lock leases, kept in the trees' database columns by default. To move
+# them off the database, use 'gists.locking.CacheLeases' with a cache shared
+# by all workers which has an atomic add(), e.g. by uncommenting the memcached
+# 'leases' cache above and setting LEASE_CACHE to 'leases' (CacheLeases
+# refuses the file-based 'default' cache): trees' heartbeats are then only
+# saved every LEASE_CHECKPOINT seconds.
+
+LEASE_BACKEND = 'gists.locking.DatabaseLeases'
+LEASE_CACHE = 'default'
+LEASE_CHECKPOINT = 60
+
+
+# Cache holding the lock which keeps workers from refreshing the /stats/
+# snapshot at the same time. The file-based cache's add() isn't atomic, so
+# with it this deduplication is best-effort (concurrent refreshes are rare
+# and harmless); point it to memcached or redis to make it strict.
+
+STATS_LOCK_CACHE = 'default'
+
+
 # Hunspell dictionary and affix files
 
 HUNSPELL = {
@@ -21,3 +21,10 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME')
     }
 }
+
+# Cache, kept in the process so it doesn't mix with the server's
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}